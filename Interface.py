@@ -19,7 +19,6 @@ import smtplib
 from toast import ToastManager
 import worker
 import checkin
-import pandas as pd
 import tkinter as tk
 from tkinter import messagebox
 from tkinter import ttk
@@ -31,7 +30,8 @@ from generate_qr import gerar_qr_para_id, enviar_qr_por_email
 from worker import enqueue, init as worker_init
 from email.mime.text import MIMEText
 from email.utils import formataddr
-from db import get_student_by_number
+from db import get_student_by_number, get_student_qr
+from student_directory import directory
 import notifier, sys, atexit
 
 
@@ -336,16 +336,13 @@ class CheckinApp:
         #self.students = load_students_from_file(self.STUDENTS_FILE)
         self.students = {}              
         self.load_students_from_db()    # preencher já da BD
-        
-        self.registo_path = os.path.join(self.REGISTOS_DIR, f"registo_{date.today()}.csv")
-        if not os.path.exists(self.registo_path):
-            df = pd.DataFrame(columns=["ID", "Nome", "Data", "Hora", "Ação"])
-            df.to_csv(self.registo_path, index=False)
+        # o CSV do dia é criado pelo checkin.CSV_MIRROR no 1.º registo
 
         # -------- UI ----------
         self.root = tk.Tk()
         self._ui_last_scan = {}  # student_id -> monotonic timestamp
         worker_init(self.root)
+        directory.start_background_refresh()
         
         self.tm = ToastManager(self.root)   # gestor de toasts leve/rápido
       
@@ -365,42 +362,76 @@ class CheckinApp:
         self._build_layout()
         self._build_menubar()  # <<<<<<<<<<<<<<  NOVO: barra de menu no topo
         self._wire_events()
+        self._atualizar_estado_sinks()
 
         # -------- Startup housekeeping ----------
-        load_scan_cache()
+        # Corre no worker (não bloqueia o construtor): a janela aparece logo; as
+        # leituras do scanner (noutros workers) esperam por checkin.state_ready.
+        # Só o estado Entrada/Saída vai na faixa INTERACTIVE (é por ele que os scans
+        # esperam); migrações, logout automático e pendentes vão em MAINTENANCE, atrás
+        # dos scans. A mesma key põe os dois no mesmo thread, por esta ordem.
+        checkin.state_ready.clear()
+        enqueue(self._startup_state, key="startup", lane=worker.INTERACTIVE)
+        enqueue(self._startup_housekeeping, key="startup", lane=worker.MAINTENANCE,
+                on_done=self._after_housekeeping)
+
+        # -------- Check for updates (UI + progress) ----------
+        self.root.after(200, self._check_updates_on_start)
+
+        # -------- Serial thread ----------
+        # Só arranca o leitor ~1.5s depois para não "competir" com a janela de update
+        self.root.after(1500, lambda: threading.Thread(target=self._iniciar_leitor_serial, daemon=True).start())
+
+    def _startup_state(self):
+        """Worker (INTERACTIVE): estado Entrada/Saída em memória; liberta os scans no fim."""
+        synced = False
         try:
-            reset_unfinished_entries()
+            load_scan_cache()
+            # 🔑 AQUI: reconstruir estado em memória a partir da BD
+            try:
+                from checkin import rebuild_last_scan_times_from_db
+                synced = rebuild_last_scan_times_from_db()
+            except Exception as e:
+                print("[BD] rebuild_last_scan_times_from_db falhou:", e)
+            checkin.start_state_reconciler()  # apanha registos feitos noutros postos
+        finally:
+            # aconteça o que acontecer, os scans não ficam à espera do arranque
+            if not synced:
+                checkin.logger.warning("[STATE] estado não sincronizado no arranque; "
+                                       "Entrada/Saída decidida pela BD em cada check-in")
+            checkin.state_ready.set()
+
+    def _startup_housekeeping(self):
+        """Worker (MAINTENANCE): migrações, logout automático e pendentes. Devolve avisos para a UI."""
+        problems = []
+        try:
+            import migrations
+            migrations.apply_pending()   # índices/tabelas novas (migrations.py)
         except Exception as e:
-            print("[BD] reset_unfinished_entries falhou:", e)
-            self._show_last_read("BD offline (reset pendente)", success=False)
-            
-        # 🔑 AQUI: reconstruir estado em memória a partir da BD
+            print("[BD] migrações falharam:", e)
         try:
-            from checkin import rebuild_last_scan_times_from_db
-            rebuild_last_scan_times_from_db()
+            # as saídas automáticas chegam ao estado em memória pelo passo (D) e pelo reconciliador
+            reset_unfinished_entries()
         except Exception as e:
-            print("[BD] rebuild_last_scan_times_from_db falhou:", e)
+            print("[BD] reset_unfinished_entries falhou:", e)
+            problems.append("BD offline (reset pendente)")
 
         try:
             flush_pending_rows()
         except Exception as e:
             print("[BD] flush_pending_rows falhou:", e)
-            self._show_last_read("BD offline (pendentes por enviar)", success=False)
-
-        
-
-        # -------- Check for updates (UI + progress) ----------
-        self.root.after(200, self._check_updates_on_start)
+            problems.append("BD offline (pendentes por enviar)")
+        return problems
 
-        # -------- Serial thread ----------
-        # Só arranca o leitor ~1.5s depois para não "competir" com a janela de update
-        self.root.after(1500, lambda: threading.Thread(target=self._iniciar_leitor_serial, daemon=True).start())
+    def _after_housekeeping(self, problems):
+        for msg in problems or []:
+            self._show_last_read(msg, success=False)
 
     def load_students_from_db(self):
         try:
-            rows = fetch_all_students(limit=5000)   # vem do db.py
-            # dicionário: "student_number" (str) -> dict completo
-            self.students = {str(r["student_number"]): r for r in rows}
+            directory.warm()   # mesma cache usada pelo check-in (student_directory.py)
+            # dicionário: "student_number" (str) -> dict (só alunos ativos)
+            self.students = directory.snapshot()
         except Exception as e:
             # loga e mantém vazio (para veres se falhou a ligação à BD)
             import logging
@@ -416,24 +447,7 @@ class CheckinApp:
     def _fetch_qr_bytes(self, student_number: int) -> bytes | None:
         """Lê o BLOB qr_code da tabela students para o aluno dado."""
         try:
-            import pymysql
-            # lê do .env (já foi carregado em __init__)
-            host = os.getenv("DB_HOST", "127.0.0.1")
-            port = int(os.getenv("DB_PORT", "3306") or "3306")
-            user = os.getenv("DB_USER", "checkin_user")
-            pwd  = os.getenv("DB_PASSWORD", "checkin_pass")
-            db   = os.getenv("DB_NAME", "checkin_db")
-            conn = pymysql.connect(host=host, port=port, user=user, password=pwd, database=db,
-                                   charset="utf8mb4", autocommit=True)
-            try:
-                with conn.cursor() as cur:
-                    cur.execute("SELECT qr_code FROM students WHERE student_number=%s", (student_number,))
-                    row = cur.fetchone()
-                    if not row or not row[0]:
-                        return None
-                    return row[0]
-            finally:
-                conn.close()
+            return get_student_qr(student_number)
         except Exception as e:
             messagebox.showerror("BD", f"Falha a obter QR da base de dados:\n{e}")
             return None
@@ -575,6 +589,10 @@ class CheckinApp:
                 if "SMTP_PORT"   in env: _chk.SMTP_PORT   = int(env["SMTP_PORT"] or "465")
                 if "SMTP_USER"   in env: _chk.SMTP_USER   = env["SMTP_USER"]
                 if "SMTP_PASS"   in env: _chk.SMTP_PASS   = env["SMTP_PASS"]
+                if any(k in env for k in ("SMTP_SERVER", "SMTP_PORT", "SMTP_USER", "SMTP_PASS")):
+                    _chk.SMTP.reset()  # sessões abertas usam as credenciais anteriores
+                    _chk.EMAIL_BREAKER.reset()
+                    _chk.OUTBOX.wake() # e os emails em espera tentam já com as novas
             except Exception:
                 pass
 
@@ -587,6 +605,12 @@ class CheckinApp:
                 if "DB_PASSWORD"  in env: _db.DB_PASS  = env["DB_PASSWORD"]
                 if "DB_NAME"      in env: _db.DB_NAME  = env["DB_NAME"]
                 if "MACHINE_NAME" in env: _db.DEVICE   = env["MACHINE_NAME"] or None
+                if any(k in env for k in ("DB_HOST", "DB_PORT", "DB_USER", "DB_PASSWORD", "DB_NAME")):
+                    _db.reset_pool()  # ligações antigas apontam para as definições anteriores
+                    _db.invalidate_schema_cache()  # outra BD pode ter outras colunas
+                    import checkin as _chk
+                    _chk.DB_BREAKER.reset()       # e o journal offline tenta já com as novas
+                    _chk.OFFLINE.wake()
             except Exception:
                 pass   
 
@@ -1019,6 +1043,12 @@ class CheckinApp:
                                  bg="white", fg="black")
         self.lbl_lido.place(relx=0.5, rely=0.8, anchor="center")
 
+        # Linha de estado (BD / Sheets / Email — circuit breakers do checkin)
+        self.estado_var = tk.StringVar(value="")
+        self.lbl_estado = tk.Label(self.root, textvariable=self.estado_var, font=("Arial", 9),
+                                   bg="white", fg="#555")
+        self.lbl_estado.place(relx=0.5, rely=1.0, anchor="s")
+
     def _build_menubar(self):
         """Barra de menu no topo (substitui o hambúrguer lateral)."""
         menubar = tk.Menu(self.root)
@@ -1139,73 +1169,77 @@ class CheckinApp:
         self.registo_frame.lift()
 
     def _atualizar_lista(self):
+        """Pede a lista de hoje ao worker; pedidos repetidos ainda na fila juntam-se num só."""
+        enqueue(self._linhas_de_hoje, lane=worker.SINK, coalesce="refresh_today",
+                on_done=lambda linhas: self._set_registos_text(linhas or ["Sem registos hoje."]),
+                on_error=lambda e: self._set_registos_text([f"Erro a carregar registos: {e}"]))
+
+    def _linhas_de_hoje(self):
+        """Worker: registos de hoje (BD; se não vier nada, o CSV do dia)."""
+        linhas = []
+        rows = []
+        db_ok = True
+        # 1) Tenta ir à BD (mais fiável)
         try:
-            linhas = []
-            rows = []
-            db_ok = True
-            # 1) Tenta ir à BD (mais fiável)
-            try:
-                #rows = fetch_today_checkins()  # [{timestamp, name, student_number, action, device_name}, ...]
-                rows = fetch_today_checkins()
-                if rows:
-                    # Ordenar por timestamp desc (por segurança)
-                    rows.sort(key=lambda r: r.get("timestamp"), reverse=True)
-                    for r in rows:
-                        ts = r.get("timestamp")
-                        # Formatar hora HH:MM:SS mesmo que venha datetime/str
-                        try:
-                            hora = ts.strftime("%H:%M:%S")
-                        except Exception:
-                            hora = str(ts)[11:19]
-                        nome = r.get("name") or ""
-                        num  = r.get("student_number")
-                        acc = r.get("action") or r.get("acao") or r.get("Ação") or ""
-                        dev = r.get("device_name") or r.get("machine") or ""
-
-                        suffix = f" [{dev}]" if dev else ""
-                        linhas.append(f"{hora} - {nome} ({num}) - {acc}{suffix}")
-            except Exception as e:
-                db_ok = False
-                # Se a BD falhar, continuamos para o CSV
-                pass
+            #rows = fetch_today_checkins()  # [{timestamp, name, student_number, action, device_name}, ...]
+            rows = fetch_today_checkins()
+            if rows:
+                # Ordenar por timestamp desc (por segurança)
+                rows.sort(key=lambda r: r.get("timestamp"), reverse=True)
+                for r in rows:
+                    ts = r.get("timestamp")
+                    # Formatar hora HH:MM:SS mesmo que venha datetime/str
+                    try:
+                        hora = ts.strftime("%H:%M:%S")
+                    except Exception:
+                        hora = str(ts)[11:19]
+                    nome = r.get("name") or ""
+                    num  = r.get("student_number")
+                    acc = r.get("action") or r.get("acao") or r.get("Ação") or ""
+                    dev = r.get("device_name") or r.get("machine") or ""
+
+                    suffix = f" [{dev}]" if dev else ""
+                    linhas.append(f"{hora} - {nome} ({num}) - {acc}{suffix}")
+        except Exception as e:
+            db_ok = False
+            # Se a BD falhar, continuamos para o CSV
+            pass
 
-            # 2) Se não vier nada da BD, usar CSV (como antes)
-            if not linhas:
-                # Recalcula o caminho do CSV de hoje sempre que atualizas
-                reg_dir = os.path.join(self.DATA_DIR, "registos")
-                reg_path = os.path.join(reg_dir, f"registo_{date.today()}.csv")
-
-                if not os.path.exists(reg_path):
-                    # fallback: tentar o CSV mais recente na pasta
-                    if os.path.isdir(reg_dir):
-                        try:
-                            candidates = [f for f in os.listdir(reg_dir) if f.startswith("registo_") and f.endswith(".csv")]
-                            if candidates:
-                                latest = max(candidates)  # nomes YYYY-MM-DD ordenam bem
-                                reg_path = os.path.join(reg_dir, latest)
-                        except Exception:
-                            pass
-
-                if os.path.exists(reg_path):
-                    import pandas as pd
-                    df = pd.read_csv(reg_path)
-                    # Filtra pelo dia de hoje, se a coluna existir
-                    if "Data" in df.columns:
-                        df = df[df["Data"] == str(date.today())]
-                    # Monta as linhas semelhantes ao original
-                    if {"Hora","Nome","Ação"}.issubset(df.columns):
-                        for _, row in df.iterrows():
-                            linhas.append(f"{row['Hora']} - {row['Nome']} ({row.get('ID','')}) - {row['Ação']}")
-                    else:
-                        # Se as colunas não corresponderem, mostra algo útil
-                        for _, row in df.tail(20).iterrows():
-                            linhas.append(" | ".join(str(v) for v in row.values))
+        # 2) Se não vier nada da BD, usar CSV (como antes)
+        if not linhas:
+            # Recalcula o caminho do CSV de hoje sempre que atualizas
+            reg_dir = os.path.join(self.DATA_DIR, "registos")
+            reg_path = os.path.join(reg_dir, f"registo_{date.today()}.csv")
+
+            if not os.path.exists(reg_path):
+                # fallback: tentar o CSV mais recente na pasta
+                if os.path.isdir(reg_dir):
+                    try:
+                        candidates = [f for f in os.listdir(reg_dir) if f.startswith("registo_") and f.endswith(".csv")]
+                        if candidates:
+                            latest = max(candidates)  # nomes YYYY-MM-DD ordenam bem
+                            reg_path = os.path.join(reg_dir, latest)
+                    except Exception:
+                        pass
+
+            if os.path.exists(reg_path):
+                import pandas as pd
+                df = pd.read_csv(reg_path)
+                # Filtra pelo dia de hoje, se a coluna existir
+                if "Data" in df.columns:
+                    df = df[df["Data"] == str(date.today())]
+                # Monta as linhas semelhantes ao original
+                if {"Hora","Nome","Ação"}.issubset(df.columns):
+                    for _, row in df.iterrows():
+                        linhas.append(f"{row['Hora']} - {row['Nome']} ({row.get('ID','')}) - {row['Ação']}")
                 else:
-                    linhas = ["Sem registos hoje."]
+                    # Se as colunas não corresponderem, mostra algo útil
+                    for _, row in df.tail(20).iterrows():
+                        linhas.append(" | ".join(str(v) for v in row.values))
+            else:
+                linhas = ["Sem registos hoje."]
 
-            self._set_registos_text(linhas or ["Sem registos hoje."])
-        except Exception as e:
-            self._set_registos_text([f"Erro a carregar registos: {e}"])
+        return linhas
 
 
     # ---------------------- Feedback helpers ----------------------
@@ -1316,29 +1350,24 @@ class CheckinApp:
             btn.config(state="disabled", text="A enviar...", cursor="watch")
             win.update_idletasks()
 
-            def enviar_async():
-                ok, err = True, None
-                try:
-                    enviar_qr_por_email(caminho_qr, nome)
-                except Exception as e:
-                    ok, err = False, e
-
-                def finish():
-                    btn.config(state="normal", text="Adicionar", cursor="")
-                    if ok:
-                        messagebox.showinfo(
-                            "Aluno Adicionado",
-                            f"Aluno {nome} adicionado com o ID {novo_id}.\nQR gerado e email enviado."
-                        )
-                        win.destroy()
-                    else:
-                        messagebox.showwarning(
-                            "QR gerado (email falhou)",
-                            f"O QR foi criado em:\n{caminho_qr}\n\nNão foi possível enviar o email:\n{err}"
-                        )
-                win.after(0, finish)
+            def email_enviado(_):
+                btn.config(state="normal", text="Adicionar", cursor="")
+                messagebox.showinfo(
+                    "Aluno Adicionado",
+                    f"Aluno {nome} adicionado com o ID {novo_id}.\nQR gerado e email enviado."
+                )
+                win.destroy()
+
+            def email_falhou(err):
+                btn.config(state="normal", text="Adicionar", cursor="")
+                messagebox.showwarning(
+                    "QR gerado (email falhou)",
+                    f"O QR foi criado em:\n{caminho_qr}\n\nNão foi possível enviar o email:\n{err}"
+                )
 
-            threading.Thread(target=enviar_async, daemon=True).start()
+            # envio no worker (faixa SINK: não passa à frente dos check-ins)
+            enqueue(enviar_qr_por_email, caminho_qr, nome, lane=worker.SINK,
+                    on_done=email_enviado, on_error=email_falhou)
 
         # Dialog UI
         win = tk.Toplevel(self.root)
@@ -1377,6 +1406,16 @@ class CheckinApp:
 
         self.root.wait_window(win)
 
+    def _atualizar_estado_sinks(self):
+        """Atualiza a linha de estado a cada 2 s (só lê contadores em memória)."""
+        try:
+            texto = checkin.sink_status()
+            self.estado_var.set(texto)
+            self.lbl_estado.config(fg="#555" if "em baixo" not in texto and "offline" not in texto else "#c0392b")
+        except Exception:
+            pass
+        self.root.after(2000, self._atualizar_estado_sinks)
+
     # ---------------------- Check-in + feedback ----------------------
 
     def _registar(self, student_id: str):
@@ -1384,26 +1423,27 @@ class CheckinApp:
         if not hasattr(self, "_ui_last_scan"):
             self._ui_last_scan = {}
 
-        # --- Debounce UI (mesmo aluno dentro de X segundos) ---
-        COOLDOWN = 10
+        # --- Debounce UI (mesmo aluno dentro de MIN_SECONDS_BETWEEN_READS) ---
+        # resposta imediata neste posto; o pipeline volta a verificar (também entre postos)
         now = time.monotonic()
-        last = self._ui_last_scan.get(student_id, 0.0)
-        if now - last < COOLDOWN:
+        last = self._ui_last_scan.get(student_id)
+        if last is not None and now - last < checkin.MIN_COOLDOWN:
             self._mostrar_feedback("Registo ignorado (duplicado)", sucesso=False)
             self._show_last_read("Duplicado", student_id, False)
             return
         self._ui_last_scan[student_id] = now
 
         # Prever ação (Entrada/Saída) com base no último estado conhecido
-        prev = getattr(checkin, "last_scan_times", {}).get(student_id)
-        tipo_guess = "Saída" if (prev and prev.get("last_tipo") == "Entrada") else "Entrada"
+        digits = "".join(ch for ch in str(student_id) if ch.isdigit())
+        tipo_guess = checkin.next_action(digits or student_id)
 
-        # Tentar obter o nome da BD (rápido). Se falhar, mostrar "Aluno <ID>".
+        # Nome a partir da cache em memória (sem ir à BD no thread do Tk).
+        # Se não estiver lá, mostrar "Aluno <ID>" — o worker refina depois.
         try:
             digits = "".join(ch for ch in str(student_id) if ch.isdigit())
             nome = None
             if digits:
-                row = get_student_by_number(int(digits))
+                row = directory.get(int(digits), load=False)
                 if row and isinstance(row, dict):
                     nome = row.get("name")
             if not nome:
@@ -1416,7 +1456,8 @@ class CheckinApp:
         self._show_last_read(nome, student_id, True)
 
         # Trabalho real (DB/Sheets/CSV/email) no worker thread
-        enqueue(log_checkin, student_id, on_done=self._after_checkin)
+        # key = nº do aluno: scans do mesmo aluno correm por ordem no mesmo worker
+        enqueue(log_checkin, student_id, key=digits or student_id, on_done=self._after_checkin)
 
 
 
@@ -1555,6 +1596,8 @@ class CheckinApp:
     # ---------------------- Public API ----------------------
     def run(self):
         self.root.mainloop()
+        # janela fechada: entregar o que ainda está nas filas dos sinks (Sheets/CSV/email)
+        checkin.drain_sinks()
 
 # --------------------------------------------------------------------------------------
 # Entrypoint
@@ -0,0 +1,103 @@
+# breaker.py — circuit breaker por sink (Sheets, email): com o serviço em baixo deixa de tentar
+import threading
+import time
+import logging
+
+logger = logging.getLogger("app")
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+
+class CircuitBreaker:
+    """
+    closed -> open -> half-open -> closed:
+      - closed: chamadas normais; `failure_threshold` falhas seguidas abrem o circuito
+      - open: allow() devolve False durante `cooloff` s (o sink fica só a guardar/buffer)
+      - half-open: passado o cooloff deixa passar UMA chamada de teste; sucesso fecha,
+        falha volta a abrir com o cooloff a dobrar (até `cooloff_max`)
+    O chamador faz: if breaker.allow(): try … success() / except: failure(e).
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 3, cooloff: float = 30.0,
+                 cooloff_max: float = 600.0):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooloff_base = cooloff
+        self.cooloff_max = max(cooloff, cooloff_max)
+
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._cooloff = cooloff
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._last_error = None
+        self._stats = {"opened": 0, "short_circuited": 0}
+
+    # ---------- API ----------
+    def allow(self) -> bool:
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN:
+                if time.monotonic() - self._opened_at < self._cooloff:
+                    self._stats["short_circuited"] += 1
+                    return False
+                self._state = HALF_OPEN
+                self._probe_in_flight = False
+            # half-open: só uma chamada de teste de cada vez
+            if self._probe_in_flight:
+                self._stats["short_circuited"] += 1
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def success(self) -> None:
+        with self._lock:
+            if self._state != CLOSED:
+                logger.info(f"[breaker] {self.name}: recuperado, circuito fechado")
+            self._state = CLOSED
+            self._failures = 0
+            self._cooloff = self.cooloff_base
+            self._probe_in_flight = False
+            self._last_error = None
+
+    def failure(self, exc: BaseException | None = None) -> None:
+        with self._lock:
+            self._failures += 1
+            self._last_error = repr(exc) if exc is not None else None
+            if self._state == HALF_OPEN:
+                self._cooloff = min(self.cooloff_max, self._cooloff * 2)
+            elif self._state == CLOSED and self._failures < self.failure_threshold:
+                return
+            self._state = OPEN
+            self._opened_at = time.monotonic()
+            self._probe_in_flight = False
+            self._stats["opened"] += 1
+            cooloff = self._cooloff
+        logger.warning(f"[breaker] {self.name}: circuito aberto durante {cooloff:.0f}s: {exc!r}")
+
+    def reset(self) -> None:
+        """Fecha já o circuito (p.ex. depois de corrigir as definições do serviço)."""
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._cooloff = self.cooloff_base
+            self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def retry_in(self) -> float:
+        """Segundos até ao próximo teste (0 se fechado / já pode testar)."""
+        with self._lock:
+            if self._state != OPEN:
+                return 0.0
+            return max(0.0, self._cooloff - (time.monotonic() - self._opened_at))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "state": self._state, "failures": self._failures,
+                    "last_error": self._last_error}
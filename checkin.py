@@ -1,10 +1,7 @@
 # checkin.py
-import io, contextlib, traceback
-from email.headerregistry import Address
-from email.policy import SMTP as SMTP_POLICY
-import os, sys, json, time, csv, logging
+import os, sys, json, time, uuid, logging, threading
+from concurrent.futures import Future
 from datetime import datetime
-import smtplib
 from email.utils import formataddr
 from email.message import EmailMessage  # EmailMessage moderno
 from email.headerregistry import Address  # <- robusto para nomes com acentos
@@ -12,14 +9,27 @@ from dotenv import load_dotenv
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 from logging.handlers import RotatingFileHandler
-from db import log_event, get_student_by_number, _connect
 from zoneinfo import ZoneInfo
 
 
 # DB: agora usamos diretamente a BD para nome/emails e registos
-from db import log_event, get_student_by_number
+from db import (_connect, record_toggle_checkin, record_checkins_batch, record_checkins_group, is_unavailable,
+                CheckinCooldown, fetch_checkins_since, last_checkin_source, auto_logout_stale_entries)
+from student_directory import directory
 
 from paths import get_paths, ensure_file
+from worker import Stage
+from sheets_sink import SheetsSink
+from journal import Journal
+from scan_state import ScanStateStore
+from csv_mirror import CsvMirror
+from smtp_pool import SmtpPool
+from outbox import Outbox
+from email_template import templates
+from html import escape
+from offline_journal import OfflineJournal
+from group_commit import GroupCommitter
+from breaker import CircuitBreaker, CLOSED, OPEN
 
 # ---------------- consola "à prova de UTF-8" ----------------
 try:
@@ -71,7 +81,15 @@ SMTP_USER   = os.getenv("SMTP_USER")
 SMTP_PASS   = os.getenv("SMTP_PASS")
 LOCAL_CSV   = os.getenv("LOCAL_CSV", "1").lower() in ("1", "true", "yes")
 DEVICE_NAME = os.getenv("MACHINE_NAME", None)  # Rececao / Piso 0
-MIN_COOLDOWN = int(os.getenv("MIN_SECONDS_BETWEEN_READS", "10") or "10")
+MIN_COOLDOWN = int(os.getenv("MIN_SECONDS_BETWEEN_READS", "10") or "10")   # leituras repetidas do mesmo aluno
+STATE_RECONCILE_SECONDS = int(os.getenv("STATE_RECONCILE_SECONDS", "60") or "60")
+# ids AUTO_INCREMENT não fazem commit por ordem (vários postos, group commit): a reconciliação
+# relê sempre os últimos N ids antes do último visto
+STATE_RECONCILE_OVERLAP = int(os.getenv("STATE_RECONCILE_OVERLAP", "500") or "500")
+# resumo de emails por encarregado: off (um email por registo) | window (a cada N s) | eod (fim do dia)
+EMAIL_DIGEST_MODE    = (os.getenv("EMAIL_DIGEST_MODE", "off") or "off").strip().lower()
+EMAIL_DIGEST_SECONDS = int(os.getenv("EMAIL_DIGEST_SECONDS", "120") or "120")
+EMAIL_DIGEST_EOD     = os.getenv("EMAIL_DIGEST_EOD", "19:30") or "19:30"   # HH:MM (Europe/Lisbon)
 
 # ---------------- Google Sheets ----------------
 SCOPE = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
@@ -87,146 +105,123 @@ except Exception as e:
     logger.error(f"Sheets auth failed: {e}")
     sheet = None
 
+# ---------------- circuit breakers (BD, Sheets, email) ----------------
+# BREAKER_FAILURES falhas seguidas abrem o circuito; durante o cooloff o sink só guarda
+# (journal offline / journal / outbox) e não espera por timeouts; depois uma tentativa
+# de teste (half-open).
+BREAKER_FAILURES    = int(os.getenv("BREAKER_FAILURES", "3") or "3")
+BREAKER_COOLOFF     = float(os.getenv("BREAKER_COOLOFF_SECONDS", "30") or "30")
+BREAKER_COOLOFF_MAX = float(os.getenv("BREAKER_COOLOFF_MAX_SECONDS", "600") or "600")
+DB_BREAKER     = CircuitBreaker("bd", BREAKER_FAILURES, BREAKER_COOLOFF, BREAKER_COOLOFF_MAX)
+SHEETS_BREAKER = CircuitBreaker("sheets", BREAKER_FAILURES, BREAKER_COOLOFF, BREAKER_COOLOFF_MAX)
+EMAIL_BREAKER  = CircuitBreaker("email", BREAKER_FAILURES, BREAKER_COOLOFF, BREAKER_COOLOFF_MAX)
+
+# ---------------- journal offline (check-ins com a BD em baixo) ----------------
+# Cada check-in que não pode ir já à BD fica em SQLite (DATA_DIR) e é reenviado em lote.
+# Com o DB_BREAKER aberto os check-ins nem tentam a BD; o replay testa-a a cada cooloff.
+OFFLINE = OfflineJournal(
+    os.path.join(DATA_DIR, "offline_checkins.sqlite3"),
+    record_checkins_batch, is_unavailable,
+    batch_size=int(os.getenv("OFFLINE_REPLAY_BATCH", "200") or "200"),
+    retry_seconds=float(os.getenv("OFFLINE_RETRY_SECONDS", "15") or "15"),
+    breaker=DB_BREAKER,
+)
+OFFLINE.start()
+
+# ---------------- group commit (escrita direta na BD) ----------------
+# Com DB_GROUP_COMMIT=1, log_checkin não espera pelo commit: a linha entra no GroupCommitter
+# e a UI é avisada quando o grupo dela fizer commit. Leituras que chegam durante um commit
+# vão juntas no seguinte (até DB_GROUP_COMMIT_MAX) — um INSERT multi-linha + UPDATE de estado.
+# Uma leitura isolada grava logo; DB_GROUP_COMMIT_MS > 0 espera esse tempo para juntar mais.
+DB_GROUP_COMMIT     = os.getenv("DB_GROUP_COMMIT", "1").lower() in ("1", "true", "yes")
+DB_GROUP_COMMIT_MS  = float(os.getenv("DB_GROUP_COMMIT_MS", "0") or "0")
+DB_GROUP_COMMIT_MAX = int(os.getenv("DB_GROUP_COMMIT_MAX", "50") or "50")
+DB_GROUP = None
+if DB_GROUP_COMMIT:
+    DB_GROUP = GroupCommitter(
+        lambda rows: record_checkins_group(rows, cooldown=MIN_COOLDOWN), is_unavailable,
+        window_ms=DB_GROUP_COMMIT_MS, max_rows=DB_GROUP_COMMIT_MAX,
+    )
+    DB_GROUP.start()
+
 # ---------------- cache (entrada/saída state) ----------------
+# student_number (str) -> {"last_scan": datetime, "last_tipo": "Entrada"|"Saída"}
+# Fonte autoritativa para o toggle Entrada/Saída; reconstruída da BD no arranque
+# e reconciliada periodicamente com os registos de outros postos.
 last_scan_times = {}
+_state_lock = threading.Lock()
+_state_synced = False          # True depois de rebuild_last_scan_times_from_db() ter corrido com sucesso
+_last_seen_checkin_id = 0      # maior checkins.id já refletido em last_scan_times
+_applied_checkin_ids: set[int] = set()   # ids já aplicados dentro da janela de sobreposição
+# Com vários workers um scan pode correr ao mesmo tempo que o arranque (logout automático,
+# rebuild). A UI limpa este evento antes de pôr o arranque na fila e volta a ligá-lo no fim;
+# log_checkin espera por ele (até STATE_READY_TIMEOUT s).
+state_ready = threading.Event()
+state_ready.set()
+STATE_READY_TIMEOUT = 20
+
+def _scan_state_copy() -> dict:
+    with _state_lock:
+        return {sid: dict(info) for sid, info in last_scan_times.items()}
+
+# snapshot (scan_cache.json) + log de alterações (scan_cache.log): um scan acrescenta uma linha
+SCAN_STATE = ScanStateStore(
+    CACHE_FILE, os.path.join(DATA_DIR, "scan_cache.log"), _scan_state_copy,
+    snapshot_every=int(os.getenv("SCAN_CACHE_SNAPSHOT_EVERY", "500") or "500"),
+)
 
 def load_scan_cache():
-    global last_scan_times
-    if os.path.exists(CACHE_FILE):
-        try:
-            with open(CACHE_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            for sid, info in data.items():
-                last_scan_times[sid] = {
-                    "last_scan": datetime.strptime(info["last_scan"], "%Y-%m-%d %H:%M:%S"),
-                    "last_tipo": info["last_tipo"],
-                }
-            logger.debug(f"Cache loaded: {last_scan_times}")
-        except Exception as e:
-            logger.error(f"Failed to read cache {CACHE_FILE}: {e}")
+    state = SCAN_STATE.load()
+    with _state_lock:
+        last_scan_times.update(state)
+    logger.debug(f"Cache loaded: {len(state)} aluno(s)")
 
 def save_scan_cache():
+    """Snapshot completo do estado (atómico); usar depois de alterações em massa."""
     try:
-        with open(CACHE_FILE, "w", encoding="utf-8") as f:
-            data = {
-                sid: {
-                    "last_scan": info["last_scan"].strftime("%Y-%m-%d %H:%M:%S"),
-                    "last_tipo": info["last_tipo"],
-                }
-                for sid, info in last_scan_times.items()
-            }
-            json.dump(data, f, indent=2, ensure_ascii=False)
+        SCAN_STATE.snapshot()
         logger.debug(f"Cache saved.")
     except Exception as e:
         logger.error(f"Failed to write cache {CACHE_FILE}: {e}")
 
-def reset_unfinished_entries():
+def record_scan_state(sid: str, last_scan: datetime, last_tipo: str) -> None:
+    """Persiste só a alteração de um aluno (uma linha no log)."""
+    try:
+        SCAN_STATE.record(sid, last_scan, last_tipo)
+    except Exception as e:
+        logger.error(f"Failed to write cache log: {e}")
+
+def reset_unfinished_entries() -> int:
     """
-    Arranque com diagnóstico + correção:
-      (A) UPDATE global: status='Saída' para quem não tem registos ou cujo último < hoje.
-      (B) INSERT (opcional via log_event): 'Saída' automática só para quem terminou < hoje em 'Entrada'.
-      (C) Verificação: inclui casos sem registos.
-      (D) Alinhar cache local.
+    Arranque:
+      (A+B) 'Saída' automática para quem ficou em 'Entrada' num dia anterior e status='Saída'
+            para quem não tem registo hoje — set-based, numa só transação
+            (db.auto_logout_stale_entries).
+      (D)   Alinhar cache local.
+    Devolve o nº de saídas automáticas inseridas.
     """
+    inserted = 0
     try:
-        # Mostrar contexto
-        with _connect() as conn, conn.cursor() as cur:
-            cur.execute("SELECT DATABASE() db, @@hostname host, NOW() now_db, CURDATE() curdate_db")
-            info = cur.fetchone() or {}
-            #print(f"[reset] DB={info.get('db')} host={info.get('host')} NOW={info.get('now_db')} CURDATE={info.get('curdate_db')}")
-
-        # (A) Corrigir status global (apanha também quem NÃO tem registos)
-        with _connect() as conn, conn.cursor() as cur:
-            cur.execute("""
-                UPDATE students s
-                LEFT JOIN (
-                  SELECT c1.student_id, MAX(c1.timestamp) AS last_ts
-                  FROM checkins c1
-                  GROUP BY c1.student_id
-                ) m ON m.student_id = s.id
-                SET s.status = 'Saída'
-                WHERE m.last_ts IS NULL OR DATE(m.last_ts) < CURDATE();
-            """)
-            #print(f"[reset] UPDATE status concluído (linhas tocadas: {cur.rowcount or 0})")
-
-        # (B) Inserir 'Saída' automática no histórico APENAS para quem ficou em Entrada ontem/antes
-        with _connect() as conn, conn.cursor() as cur:
-            cur.execute("""
-                SELECT s.student_number, s.name, last.timestamp AS last_ts
-                FROM students s
-                JOIN (
-                  SELECT c1.student_id, c1.action, c1.timestamp
-                  FROM checkins c1
-                  JOIN (
-                    SELECT student_id, MAX(timestamp) AS last_ts
-                    FROM checkins
-                    GROUP BY student_id
-                  ) m ON m.student_id = c1.student_id AND m.last_ts = c1.timestamp
-                ) last ON last.student_id = s.id
-                WHERE last.action='Entrada' AND DATE(last.timestamp) < CURDATE()
-            """)
-            candidates = cur.fetchall() or []
-            #print(f"[reset] candidatos a 'Saída' automática (último=Entrada < hoje): {len(candidates)}")
-            for r in candidates[:8]:
-                print(f"  - {r['student_number']} {r['name']} (último={r['last_ts']})")
-
-        ok = fail = 0
-        for r in candidates:
-            try:
-                ts = datetime.now(ZoneInfo("Europe/Lisbon")).replace(tzinfo=None)
-                log_event(int(r["student_number"]), "Saída", device_name="Logout Automático",ts=ts)  # escreve em checkins e atualiza students.status
-                ok += 1
-            except Exception as e:
-                print(f"[reset] ERRO log_event({r['student_number']}): {e}")
-                fail += 1
-        #print(f"[reset] auto-saídas inseridas: OK={ok} FAIL={fail}")
-
-        # (C) Verificação — agora inclui quem NÃO tem registos
-        with _connect() as conn, conn.cursor() as cur:
-            cur.execute("""
-                SELECT COUNT(*) AS n
-                FROM students s
-                LEFT JOIN (
-                  SELECT c1.student_id, MAX(c1.timestamp) AS last_ts
-                  FROM checkins c1
-                  GROUP BY c1.student_id
-                ) m ON m.student_id = s.id
-                WHERE s.status='Entrada' AND (m.last_ts IS NULL OR DATE(m.last_ts) < CURDATE());
-            """)
-            leftover = (cur.fetchone() or {}).get("n", 0)
-            #print(f"[reset] ainda em 'Entrada' sem registo hoje (inclui sem-registos): {leftover}")
-
-            if leftover:
-                cur.execute("""
-                    SELECT s.student_number, s.name, m.last_ts
-                    FROM students s
-                    LEFT JOIN (
-                      SELECT c1.student_id, MAX(c1.timestamp) AS last_ts
-                      FROM checkins c1
-                      GROUP BY c1.student_id
-                    ) m ON m.student_id = s.id
-                    WHERE s.status='Entrada' AND (m.last_ts IS NULL OR DATE(m.last_ts) < CURDATE())
-                    ORDER BY m.last_ts DESC NULLS LAST
-                    LIMIT 10;
-                """)
-                for x in (cur.fetchall() or []):
-                    print(f"    » {x['student_number']} {x['name']}  last_ts={x['last_ts']}")
-
+        inserted = auto_logout_stale_entries(device_name="Logout Automático")
+        logger.info(f"[reset] saídas automáticas inseridas: {inserted}")
     except Exception as e:
         print(f"[reset] ERRO: {e}")
+        logger.error(f"[reset] auto-logout falhou: {e}")
 
     # (D) Cache local — para não alternar mal no 1.º scan
     today = datetime.now(ZoneInfo("Europe/Lisbon")).date()
-    for sid, info in list(last_scan_times.items()):
-        try:
-            if info["last_scan"].date() < today and info["last_tipo"] == "Entrada":
-                last_scan_times[sid]["last_tipo"] = "Saída"
-        except Exception:
-            pass
+    with _state_lock:
+        for sid, info in list(last_scan_times.items()):
+            try:
+                if info["last_scan"].date() < today and info["last_tipo"] == "Entrada":
+                    last_scan_times[sid]["last_tipo"] = "Saída"
+            except Exception:
+                pass
     try:
         save_scan_cache()
     except Exception:
         pass
+    return inserted
 
 
 def rebuild_last_scan_times_from_db():
@@ -235,32 +230,38 @@ def rebuild_last_scan_times_from_db():
     de cada aluno na base de dados.
 
     Deve ser chamada UMA vez no arranque da app, depois do
-    reset_unfinished_entries().
+    reset_unfinished_entries(). Devolve False se a BD não respondeu.
     """
-    global last_scan_times
-    last_scan_times = {}
+    global _state_synced, _last_seen_checkin_id
 
     try:
         with _connect() as conn, conn.cursor() as cur:
-            cur.execute("""
-                SELECT s.student_number, c.action, c.timestamp
-                FROM checkins c
-                JOIN students s ON s.id = c.student_id
-                JOIN (
-                    SELECT student_id, MAX(timestamp) AS last_ts
-                    FROM checkins
-                    GROUP BY student_id
-                ) m ON m.student_id = c.student_id
-                   AND m.last_ts = c.timestamp
+            cur.execute("SELECT COALESCE(MAX(id), 0) AS max_id FROM checkins")
+            max_id = int((cur.fetchone() or {}).get("max_id") or 0)
+            cur.execute(f"""
+                SELECT s.student_number, l.action, l.timestamp
+                FROM {last_checkin_source(cur)} l
+                JOIN students s ON s.id = l.student_id
             """)
             rows = cur.fetchall() or []
 
-        for r in rows:
-            sid = str(r["student_number"])
-            last_scan_times[sid] = {
-                "last_scan": r["timestamp"],
-                "last_tipo": r["action"],
-            }
+        with _state_lock:
+            last_scan_times.clear()
+            for r in rows:
+                sid = str(r["student_number"])
+                last_scan_times[sid] = {
+                    "last_scan": r["timestamp"],
+                    "last_tipo": r["action"],
+                }
+            # check-ins feitos offline que a BD ainda não tem
+            for r in OFFLINE.pending_entries():
+                sid = str(r["student_number"])
+                cur = last_scan_times.get(sid)
+                if cur is None or r["timestamp"] >= cur["last_scan"]:
+                    last_scan_times[sid] = {"last_scan": r["timestamp"], "last_tipo": r["action"]}
+            _last_seen_checkin_id = max_id
+            _applied_checkin_ids.clear()
+            _state_synced = True
 
         logger.info(f"[STATE] rebuild_last_scan_times_from_db: {len(last_scan_times)} aluno(s) sincronizados")
 
@@ -269,218 +270,344 @@ def rebuild_last_scan_times_from_db():
             save_scan_cache()
         except Exception:
             pass
+        return True
 
     except Exception as e:
         logger.error(f"[STATE] Falha no rebuild_last_scan_times_from_db: {e}")
+        return False
+
+
+def reconcile_last_scan_times() -> int:
+    """
+    Aplica a last_scan_times os registos feitos desde o último visto (outros postos,
+    logout automático, …). Lê checkins.id > último id - STATE_RECONCILE_OVERLAP (pela PK,
+    sem filesort): um id mais baixo que só fez commit depois de um mais alto ainda é
+    apanhado; os ids já aplicados nessa janela são ignorados.
+    Devolve o nº de alunos cujo estado mudou.
+    """
+    global _last_seen_checkin_id, _applied_checkin_ids
+    if not _state_synced:
+        rebuild_last_scan_times_from_db()
+        return len(last_scan_times)
+
+    rows = fetch_checkins_since(max(0, _last_seen_checkin_id - STATE_RECONCILE_OVERLAP))
+    changed = {}
+    with _state_lock:
+        for r in rows:
+            if int(r["id"]) in _applied_checkin_ids:
+                continue
+            _applied_checkin_ids.add(int(r["id"]))
+            sid = str(r["student_number"])
+            cur = last_scan_times.get(sid)
+            if cur is None or r["timestamp"] >= cur["last_scan"]:
+                if cur is None or cur["last_tipo"] != r["action"] or cur["last_scan"] != r["timestamp"]:
+                    changed[sid] = (r["timestamp"], r["action"])
+                last_scan_times[sid] = {"last_scan": r["timestamp"], "last_tipo": r["action"]}
+            _last_seen_checkin_id = max(_last_seen_checkin_id, int(r["id"]))
+        floor = _last_seen_checkin_id - STATE_RECONCILE_OVERLAP
+        _applied_checkin_ids = {i for i in _applied_checkin_ids if i > floor}
+    for sid, (ts, tipo) in changed.items():
+        record_scan_state(sid, ts, tipo)
+    changed = len(changed)
+    if changed:
+        logger.info(f"[STATE] reconciliação: {changed} aluno(s) atualizados a partir da BD")
+    return changed
+
+
+def start_state_reconciler(interval: int | None = None) -> None:
+    """Thread em background que corre reconcile_last_scan_times() a cada `interval` segundos."""
+    period = interval or STATE_RECONCILE_SECONDS
+
+    def _loop():
+        while True:
+            time.sleep(period)
+            try:
+                reconcile_last_scan_times()
+            except Exception as e:
+                logger.warning(f"[STATE] reconciliação falhou: {e}")
+
+    threading.Thread(target=_loop, name="StateReconciler", daemon=True).start()
 
 
+def next_action(student_key: str) -> str:
+    """
+    Entrada/Saída seguinte para o aluno, a partir do estado em memória. Uma 'Entrada' de
+    um dia anterior conta como fechada (o logout automático do arranque dá-lhe a 'Saída'),
+    mesmo que esse logout ainda não tenha corrido.
+    """
+    today = datetime.now(ZoneInfo("Europe/Lisbon")).date()
+    with _state_lock:
+        prev = last_scan_times.get(str(student_key))
+    if prev and prev.get("last_tipo") == "Entrada" and prev["last_scan"].date() >= today:
+        return "Saída"
+    return "Entrada"
 
 
 # ---------------- local CSV mirror ----------------
-def _ensure_day_csv(ts: datetime) -> str:
-    os.makedirs(REGISTOS_DIR, exist_ok=True)
-    path = os.path.join(REGISTOS_DIR, f"registo_{ts.date()}.csv")
-    if not os.path.exists(path):
-        with open(path, "w", encoding="utf-8", newline="") as f:
-            csv.writer(f).writerow(["ID", "Nome", "Data", "Hora", "Ação"])
-    return path
+CSV_MIRROR = CsvMirror(
+    REGISTOS_DIR,
+    flush_interval=float(os.getenv("LOCAL_CSV_FLUSH_SECONDS", "2") or "2"),
+)
 
 def append_local_record(student_id: str, student_name: str, tipo: str, ts: datetime) -> None:
-    path = _ensure_day_csv(ts)
-    with open(path, "a", encoding="utf-8", newline="") as f:
-        csv.writer(f).writerow([student_id, student_name, str(ts.date()), ts.strftime("%H:%M:%S"), tipo])
+    CSV_MIRROR.write(student_id, student_name, tipo, ts)
 
 # ---------------- pending rows (when offline) ----------------
-def _load_pending():
+# Journal append-only (JSON-lines): cada linha do Sheets é acrescentada ao ficheiro e o
+# SheetsSink avança o offset quando o append_rows corre bem. Sem reescrever o ficheiro todo.
+PENDING_JOURNAL = os.path.join(DATA_DIR, "pending_rows.jsonl")
+
+def _migrate_legacy_pending(journal: Journal) -> None:
+    """pending_rows.json (formato antigo, lista JSON) -> journal; o ficheiro antigo fica como .migrated."""
     if not os.path.exists(PENDING_FILE):
-        return []
+        return
     try:
         with open(PENDING_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
+            rows = json.load(f) or []
     except Exception as e:
         logger.error(f"Failed to read {PENDING_FILE}: {e}")
-        return []
-
-def _save_pending(rows):
-    try:
-        with open(PENDING_FILE, "w", encoding="utf-8") as f:
-            json.dump(rows, f, indent=2, ensure_ascii=False)
-    except Exception as e:
-        logger.error(f"Failed to write {PENDING_FILE}: {e}")
+        return
+    for row in rows:
+        journal.append(row)
+    journal.sync()
+    os.replace(PENDING_FILE, PENDING_FILE + ".migrated")
+    if rows:
+        logger.info(f"{len(rows)} linha(s) pendente(s) migradas para {os.path.basename(PENDING_JOURNAL)}")
+
+PENDING = Journal(
+    PENDING_JOURNAL,
+    fsync_every=int(os.getenv("PENDING_FSYNC_EVERY", "20") or "20"),
+    fsync_interval=float(os.getenv("PENDING_FSYNC_SECONDS", "1") or "1"),
+)
+_migrate_legacy_pending(PENDING)
+
+# ---------------- Sheets em lote ----------------
+SHEETS = SheetsSink(
+    lambda: sheet, PENDING,
+    interval=float(os.getenv("SHEETS_FLUSH_SECONDS", "5") or "5"),
+    batch_size=int(os.getenv("SHEETS_BATCH_SIZE", "50") or "50"),
+    breaker=SHEETS_BREAKER,
+)
 
 def append_row_resilient(row):
-    if sheet is None:
-        pending = _load_pending(); pending.append(row); _save_pending(pending)
-        logger.info("Sheets disabled/offline; buffered row.")
-        return False
-    try:
-        sheet.append_row(row)
-        logger.info(f"Sheet append OK: {row}")
-        flush_pending_rows()
-        return True
-    except Exception as e:
-        logger.error(f"Sheet append failed; buffering: {e}")
-        pending = _load_pending(); pending.append(row); _save_pending(pending)
-        return False
+    """Acrescenta a linha ao journal de pendentes; o SheetsSink envia-a no próximo append_rows."""
+    SHEETS.submit(row)
+    return True
 
 def flush_pending_rows():
-    pending = _load_pending()
-    if not pending or sheet is None:
-        return
-    still = []
-    for row in pending:
-        try:
-            sheet.append_row(row)
-        except Exception as e:
-            logger.warning(f"Flush failed for {row}: {e}")
-            still.append(row)
-    _save_pending(still)
+    """Envia já as linhas pendentes do journal (em append_rows de até SheetsSink.max_rows)."""
+    return SHEETS.flush()
 
 # ---------------- email ----------------
-def _load_email_template() -> str:
-    try:
-        with open(EMAIL_HTML, "r", encoding="utf-8") as file:
-            return file.read()
-    except Exception as e:
-        logger.error(f"Failed to read template {EMAIL_HTML}: {e}")
-        return "<p>{nome}: {tipo} às {hora}</p>"
+_EMAIL_FALLBACK = "<p>{{nome}}: {{tipo}} às {{hora}}</p>"
 
 def _build_email_html(name: str, tipo: str, timestamp_str: str) -> str:
-    html_template = _load_email_template()
+    """email.html compilado e em cache (relido só quando o ficheiro muda)."""
     hora = timestamp_str[9:14] if len(timestamp_str) >= 14 else timestamp_str
-    return (
-        html_template
-        .replace("{{nome}}", name)
-        .replace("{{tipo}}", tipo.lower())
-        .replace("{{hora}}", hora)
-    )
+    return templates.render(EMAIL_HTML, {"nome": name, "tipo": tipo.lower(), "hora": hora},
+                            default=_EMAIL_FALLBACK)
 
 def _address_from_display_email(display_name: str, email_addr: str) -> Address:
     """Cria um Address que codifica corretamente nomes com acentos no header."""
     local, _, domain = (email_addr or "").partition("@")
     return Address(display_name=display_name or "", username=local, domain=domain)
 
-import io, contextlib, traceback
-from email.headerregistry import Address
-from email.policy import SMTP as SMTP_POLICY
-
-def _address_from_display_email(display_name: str, email_addr: str) -> Address:
-    local, _, domain = (email_addr or "").partition("@")
-    return Address(display_name=display_name or "", username=local, domain=domain)
-
-def _smtp_debug_to_logger(smtp_obj, logger):
-    """
-    Redireciona o debug do smtplib para o logger (nível DEBUG) usando um buffer.
-    Usar com redirect_stdout no bloco em que se faz EHLO/STARTTLS/send.
-    """
-    smtp_obj.set_debuglevel(1)
-    buf = io.StringIO()
-    return buf, contextlib.redirect_stdout(buf), lambda: logger.debug("SMTP DEBUG:\n%s", buf.getvalue())
+# sessões SMTP autenticadas reutilizadas entre check-ins (lê SMTP_* a cada envio)
+SMTP = SmtpPool(
+    lambda: (SMTP_SERVER, SMTP_PORT, SMTP_USER, SMTP_PASS),
+    size=int(os.getenv("SMTP_POOL_SIZE", "1") or "1"),
+    keepalive=float(os.getenv("SMTP_KEEPALIVE_SECONDS", "60") or "60"),
+    max_idle=float(os.getenv("SMTP_MAX_IDLE_SECONDS", "900") or "900"),
+    timeout=int(os.getenv("SMTP_TIMEOUT", "60") or "60"),
+    force_ipv4=os.getenv("SMTP_FORCE_IPV4", "0") in ("1", "true", "yes"),
+)
+SMTP.start_keepalive()
+
+def _send_outbox_entry(entry: dict) -> None:
+    """Sender da OUTBOX: uma mensagem, um destinatário, pela sessão SMTP reutilizada."""
+    msg = EmailMessage()
+    msg.set_content(entry["text"])
+    if entry.get("html"):
+        msg.add_alternative(entry["html"], subtype="html")
+    msg["From"] = formataddr(("ASFormação", SMTP_USER or ""))
+    msg["To"] = entry["to"]
+    msg["Subject"] = entry["subject"]
+    peer = SMTP.send(msg)
+    logger.info("Email: enviado OK | to=%s | subj=%r | via %s", entry["to"], entry["subject"], peer)
+
+# emails por enviar ficam em DATA_DIR/outbox; o check-in só os acrescenta
+OUTBOX = Outbox(
+    os.path.join(DATA_DIR, "outbox"), _send_outbox_entry,
+    max_attempts=int(os.getenv("EMAIL_MAX_ATTEMPTS", "8") or "8"),
+    backoff_base=float(os.getenv("EMAIL_RETRY_SECONDS", "30") or "30"),
+    breaker=EMAIL_BREAKER,
+)
+OUTBOX.start()
 
 def send_email_db(name: str, email1: str | None, email2: str | None,
                   tipo: str, timestamp_str: str):
-    import socket, ssl, smtplib
-
+    """
+    Põe o aviso ao encarregado na OUTBOX (uma mensagem por destinatário; repetidos ignorados).
+    Em modo resumo (EMAIL_DIGEST_MODE) fica no journal do resumo até ao próximo envio agrupado.
+    """
     recipients = [e for e in [(email1 or "").strip(), (email2 or "").strip()] if e]
     if not recipients:
         logger.warning("Email: sem destinatários (email1=%r, email2=%r) — a ignorar envio.",
                        email1, email2)
         return
 
+    if EMAIL_DIGEST_MODE in ("window", "eod"):
+        for to in dict.fromkeys(recipients):
+            DIGEST.append({"to": to, "name": name, "tipo": tipo, "ts": timestamp_str})
+        logger.info("Email: %s no resumo (%d pendente(s))", ", ".join(recipients), DIGEST.pending_count())
+        return
+
     html_content = _build_email_html(name, tipo, timestamp_str)
     subject = f"Registo de {tipo} de {name}"
-
-    msg = EmailMessage()
-    msg.set_content(f"{name}: {tipo} às {timestamp_str}")
-    msg.add_alternative(html_content, subtype="html")
-    from_display = "ASFormação"
-    from_addr = SMTP_USER or ""
-    msg["From"] = formataddr((from_display, from_addr))
-    msg["To"] = ", ".join(recipients)
-    msg["Subject"] = subject
-
-    # Resolver IPv4/IPv6
-    family = socket.AF_INET if os.getenv("SMTP_FORCE_IPV4", "0") in ("1", "true", "yes") else socket.AF_UNSPEC
+    text = f"{name}: {tipo} às {timestamp_str}"
+    for to in dict.fromkeys(recipients):
+        OUTBOX.enqueue(to, subject, text, html_content, dedup_key=f"{name}|{tipo}|{timestamp_str}")
+    logger.info("Email: em fila para %s | outbox=%d", ", ".join(recipients), OUTBOX.depth())
+
+# ---------------- email: modo resumo ----------------
+# Avisos por enviar (um por destinatário) num journal append-only; flush_email_digest()
+# agrupa-os por endereço e põe UMA mensagem por encarregado na OUTBOX.
+DIGEST = Journal(os.path.join(DATA_DIR, "email_digest.jsonl"))
+
+def _digest_message(items: list[dict]) -> tuple[str, str, str]:
+    """(assunto, texto, html) de um resumo; com um só registo usa o email normal."""
+    if len(items) == 1:
+        it = items[0]
+        return (f"Registo de {it['tipo']} de {it['name']}",
+                f"{it['name']}: {it['tipo']} às {it['ts']}",
+                _build_email_html(it["name"], it["tipo"], it["ts"]))
+    names = list(dict.fromkeys(it["name"] for it in items))
+    subject = f"Resumo de registos: {', '.join(names)}"
+    lines = [f"{it['ts']} — {it['name']}: {it['tipo'].lower()}" for it in items]
+    html = ("<p>Registos de entrada/saída:</p><ul>"
+            + "".join(f"<li>{escape(line)}</li>" for line in lines)
+            + "</ul>")
+    return subject, "\n".join(lines), html
+
+def flush_email_digest() -> int:
+    """Envia (para a OUTBOX) um resumo por destinatário com tudo o que está pendente."""
+    items, pos = DIGEST.peek()
+    if not items:
+        return 0
+    by_to: dict[str, list[dict]] = {}
+    for it in items:
+        by_to.setdefault(it["to"], []).append(it)
+    for to, group in by_to.items():
+        subject, text, html = _digest_message(group)
+        OUTBOX.enqueue(to, subject, text, html,
+                       dedup_key="digest|" + "|".join(f"{it['name']}|{it['tipo']}|{it['ts']}" for it in group))
+    DIGEST.commit(pos)
+    logger.info(f"Email: resumo de {len(items)} registo(s) para {len(by_to)} destinatário(s)")
+    return len(by_to)
+
+def _digest_due_eod(now: datetime, last_day) -> bool:
+    hh, _, mm = EMAIL_DIGEST_EOD.partition(":")
+    eod = now.replace(hour=int(hh or 0), minute=int(mm or 0), second=0, microsecond=0)
+    return now >= eod and last_day != now.date()
+
+def _digest_loop():
+    tz = ZoneInfo("Europe/Lisbon")
+    last_day = None
+    # modo desligado entretanto, ou registos de dias anteriores (app fechada ao fim do dia): enviar já
+    today = datetime.now(tz).date()
+    items, _ = DIGEST.peek()
+    if items and (EMAIL_DIGEST_MODE != "eod"
+                  or any(datetime.strptime(it["ts"][:8], "%d-%m-%y").date() < today for it in items)):
+        _safe_flush_digest()
+    while EMAIL_DIGEST_MODE in ("window", "eod"):
+        time.sleep(EMAIL_DIGEST_SECONDS if EMAIL_DIGEST_MODE == "window" else 30)
+        if EMAIL_DIGEST_MODE == "window":
+            _safe_flush_digest()
+            continue
+        now = datetime.now(tz).replace(tzinfo=None)
+        if _digest_due_eod(now, last_day):
+            _safe_flush_digest()
+            last_day = now.date()
+
+def _safe_flush_digest():
     try:
-        infos = socket.getaddrinfo(SMTP_SERVER, SMTP_PORT, family, socket.SOCK_STREAM)
+        flush_email_digest()
     except Exception as e:
-        logger.error("SMTP: falha a resolver %s:%s (%s)", SMTP_SERVER, SMTP_PORT, e)
-        return
-
-    infos.sort(key=lambda x: 0 if x[0] == socket.AF_INET else 1)  # IPv4 primeiro
-    TIMEOUT = int(os.getenv("SMTP_TIMEOUT", "60") or "60")
-    context = ssl.create_default_context()
-
-    last_err = None
-    for af, socktype, proto, _, sockaddr in infos:
-        ip = sockaddr[0]
-        ipver = "IPv4" if af == socket.AF_INET else "IPv6"
-        try:
-            logger.info("SMTP: tentar %s %s:%s (%s)", SMTP_SERVER, ip, SMTP_PORT, ipver)
-
-            with socket.create_connection((ip, SMTP_PORT), timeout=TIMEOUT) as raw:
-                with context.wrap_socket(raw, server_hostname=SMTP_SERVER) as tls_sock:
-                    server = smtplib.SMTP_SSL()
-                    #server.set_debuglevel(1)
-                    try:
-                        server.sock = tls_sock
-                        server.file = server.sock.makefile("rb")
-
-                        code, banner = server.getreply()
-                        if code != 220:
-                            raise smtplib.SMTPResponseException(code, banner)
-
-                        server.ehlo("asf-checkin")  # hostname neutro
-                        if SMTP_USER:
-                            server.login(SMTP_USER, SMTP_PASS)
-
-                        mail_opts = []
-                        if server.has_extn('smtputf8'):
-                            mail_opts.append('SMTPUTF8')
-
-                        server.send_message(msg, mail_options=mail_opts)
-
-                    finally:
-                        try:
-                            server.quit()
-                        except Exception:
-                            server.close()
-
-            logger.info("Email: enviado OK | to=%s | subj=%r | via %s %s:%s",
-                        ", ".join(recipients), subject, ipver, ip, SMTP_PORT)
-            return
-        except Exception as e:
-            last_err = e
-            logger.error("SMTP: falha via %s %s:%s | err=%r", ipver, ip, SMTP_PORT, e)
-
-    logger.error("Email: falhou em todos os IPs | último erro: %r", last_err)
-
-
-
-
+        logger.error(f"Email: resumo falhou: {e}")
+
+threading.Thread(target=_digest_loop, name="EmailDigest", daemon=True).start()
+
+
+# ---------------- pipeline: sinks assíncronos ----------------
+def _sink_csv(ev):
+    append_local_record(ev["student_id"], ev["name"], ev["tipo"], ev["ts"])
+
+def _sink_cache(ev):
+    record_scan_state(ev["key"], ev["ts"], ev["tipo"])
+
+def _sink_email(ev):
+    send_email_db(ev["name"], ev["email1"], ev["email2"], ev["tipo"], ev["formatted"])
+
+SINKS = {
+    "csv":    Stage("csv", _sink_csv),
+    "cache":  Stage("cache", _sink_cache),
+    "email":  Stage("email", _sink_email),
+}
+
+def _fan_out(event: dict) -> None:
+    """Entrega o check-in (já gravado na BD) a cada sink, sem esperar por nenhum."""
+    append_row_resilient([event["formatted"], event["student_id"], event["name"], event["tipo"]])
+    for name, stage in SINKS.items():
+        if name == "csv" and not LOCAL_CSV:
+            continue
+        stage.submit(event)
+
+def drain_sinks(timeout: float = 10.0) -> bool:
+    """Espera que os sinks esvaziem (usar ao fechar a app). True se ficou tudo entregue."""
+    deadline = time.monotonic() + timeout
+    # primeiro o grupo que falta gravar na BD: os commits dele ainda alimentam os sinks
+    ok = DB_GROUP is None or DB_GROUP.close(max(0.0, deadline - time.monotonic()))
+    # depois: as stages deixam de aceitar itens na fila e esvaziam o que têm…
+    for stage in SINKS.values():
+        stage.close()
+    ok = all([stage.drain(max(0.0, deadline - time.monotonic())) for stage in SINKS.values()]) and ok
+    # …e só então se fecham os back ends onde elas escrevem
+    SCAN_STATE.close()
+    CSV_MIRROR.close()
+    SMTP.close()
+    return SHEETS.close(max(0.0, deadline - time.monotonic())) and ok
+
+# ---------------- estado dos sinks (linha de estado da UI) ----------------
+def sink_status() -> str:
+    """Resumo curto do estado da BD e dos circuit breakers, p.ex. "BD: OK · Sheets: em baixo (12 em espera…)"."""
+    db = OFFLINE.stats()
+    if not db["healthy"] and DB_BREAKER.state == OPEN:
+        parts = [f"BD: offline ({db['pending']} por enviar, novo teste em {DB_BREAKER.retry_in():.0f}s)"]
+    elif not db["healthy"]:
+        parts = [f"BD: offline ({db['pending']} por enviar)"]
+    elif db["pending"]:
+        parts = [f"BD: a enviar {db['pending']}"]
+    else:
+        parts = ["BD: OK"]
+    for label, br, waiting in (("Sheets", SHEETS_BREAKER, PENDING.pending_count),
+                               ("Email", EMAIL_BREAKER, OUTBOX.depth)):
+        state = br.state
+        if state == CLOSED:
+            parts.append(f"{label}: OK")
+        elif state == OPEN:
+            parts.append(f"{label}: em baixo ({waiting()} em espera, novo teste em {br.retry_in():.0f}s)")
+        else:
+            parts.append(f"{label}: a testar…")
+    return " · ".join(parts)
 
 # ---------------- main check-in API ----------------
 def log_checkin(student_id):
+    """
+    Check-in de uma leitura. Devolve (nome, tipo), None se ignorada — ou, com group commit,
+    um Future que resolve para isso depois do commit (o worker só chama on_done então).
+    """
     start = time.time()
     ts = datetime.now(ZoneInfo("Europe/Lisbon")).replace(tzinfo=None)
-    cooldown = MIN_COOLDOWN
-    tipo = "Entrada"
-
-     # toggle entrada/saída baseado no último registo na BD
-    try:
-        with _connect() as conn, conn.cursor() as cur:
-            cur.execute(
-                "SELECT action FROM checkins c "
-                "JOIN students s ON s.id=c.student_id "
-                "WHERE s.student_number=%s "
-                "ORDER BY c.timestamp DESC LIMIT 1",
-                (int(''.join(ch for ch in str(student_id) if ch.isdigit())),)
-            )
-            r = cur.fetchone()
-            if r and r.get("action") in ("Entrada", "Saída"):
-                tipo = "Saída" if r["action"] == "Entrada" else "Entrada"
-    except Exception as e:
-        logger.warning(f"Falha a obter último registo pela BD: {e}")
 
     # Extrair número para a BD
     digits = "".join(ch for ch in str(student_id) if ch.isdigit())
@@ -488,45 +615,127 @@ def log_checkin(student_id):
         logger.warning(f"QR inválido (sem dígitos): {student_id!r}")
         return
     sid_num = int(digits)
+    key = str(sid_num)
+
+    # Leitura repetida dentro de MIN_COOLDOWN s (neste posto, ou noutro já visto pelo
+    # reconciliador) -> recusada antes de qualquer BD/Sheets/email
+    if MIN_COOLDOWN > 0:
+        with _state_lock:
+            prev = last_scan_times.get(key)
+        if prev and prev.get("last_scan") and abs((ts - prev["last_scan"]).total_seconds()) < MIN_COOLDOWN:
+            logger.info(f"Leitura repetida ignorada: {sid_num} (último registo às "
+                        f"{prev['last_scan']:%H:%M:%S}, cooldown {MIN_COOLDOWN}s)")
+            return
 
-    # Buscar aluno na BD (NÃO criar)
+    # Buscar aluno (memória; BD só num miss e só com a BD saudável) — NÃO criar.
+    # BD em baixo (p.ex. desde o arranque, diretório vazio): o check-in não se perde —
+    # segue como "Aluno N" para o journal offline; o replay ignora números que não existam.
+    db_down = not OFFLINE.healthy
     try:
-        row = get_student_by_number(sid_num)  # esperado: dict com keys name, email1, email2
+        row = directory.get(sid_num, load=not db_down)  # esperado: dict com keys name, email1, email2
     except Exception as e:
-        logger.error(f"DB read failed for student {sid_num}: {e}")
-        return
+        if not is_unavailable(e):
+            logger.error(f"DB read failed for student {sid_num}: {e}")
+            return
+        OFFLINE.mark_unhealthy(e)
+        db_down, row = True, None
+    if not row and db_down:
+        logger.warning(f"BD indisponível: aluno {sid_num} não verificado, registo guardado offline")
+        row = {"name": f"Aluno {sid_num}"}
 
     if not row:
         logger.info(f"Unknown QR (not in DB): {student_id} (num={sid_num})")
         return  # UI deve mostrar "QR não reconhecido na base de dados"
 
+    # toggle entrada/saída a partir do estado em memória (sincronizado com a BD). Na escrita
+    # direta a BD decide com a linha do aluno bloqueada e corrige esta previsão se preciso;
+    # offline fica a previsão.
+    if not state_ready.wait(STATE_READY_TIMEOUT):
+        logger.warning("Arranque ainda a decorrer; a decidir Entrada/Saída sem estado sincronizado")
+    tipo = next_action(key)
+
     student_name = (row.get("name") or f"Aluno {sid_num}") if isinstance(row, dict) else f"Aluno {sid_num}"
     email1 = row.get("email1") if isinstance(row, dict) else None
     email2 = row.get("email2") if isinstance(row, dict) else None
 
-    # 1) MariaDB primeiro (fonte principal)
-    try:
-        log_event(sid_num, tipo, DEVICE_NAME,ts)
-    except Exception as e:
-        # não quebrar — Sheets é backup, mas sem DB não há registo "oficial"
-        logger.warning(f"DB write skipped/failure: {e}")
-
-    # 2) Backup para Sheets
-    formatted = ts.strftime("%d-%m-%y %H:%M:%S")
-    append_row_resilient([formatted, student_id, student_name, tipo])
+    # 1) MariaDB primeiro (fonte principal). Com a BD em baixo — ou check-ins offline ainda
+    #    por enviar à frente deste — vai para o journal offline sem tentar a ligação.
+    #    A client_key (uuid gerado aqui) torna repetições/replays idempotentes na BD.
+    #    O cooldown e o toggle são verificados outra vez na BD: apanham leituras noutro
+    #    posto que o reconciliador ainda não trouxe.
+    scan = {
+        "student_id": student_id, "sid_num": sid_num, "key": key, "name": student_name,
+        "tipo": tipo, "ts": ts, "email1": email1, "email2": email2,
+        "client_key": uuid.uuid4().hex, "start": start,
+    }
+    if not OFFLINE.accepting_direct:
+        return _complete_checkin(scan, None)
+    if DB_GROUP is None:
+        try:
+            written = record_toggle_checkin(sid_num, DEVICE_NAME, ts, client_key=scan["client_key"],
+                                            cooldown=MIN_COOLDOWN)
+        except Exception as e:
+            written = e
+        return _complete_checkin(scan, written)
 
-    # 3) (Opcional) CSV espelho
-    if LOCAL_CSV:
-        append_local_record(student_id, student_name, tipo, ts)
+    # group commit: o worker segue para a leitura seguinte; a UI é avisada (on_done) quando
+    # o grupo desta linha fizer commit
+    done = Future()
 
-    # Cache + email
-    last_scan_times[student_id] = {"last_scan": ts, "last_tipo": tipo}
-    save_scan_cache()
+    def _on_commit(f):
+        try:
+            done.set_result(_complete_checkin(scan, f.exception() or f.result()))
+        except Exception as e:
+            done.set_exception(e)
 
-    logger.info(f"{tipo} registada: {student_name} ({student_id}) às {formatted}  in {time.time()-start:.3f}s")
-    try:
-        send_email_db(student_name, email1, email2, tipo, formatted)
-    except Exception as e:
-        logger.warning(f"Email send failed: {e}")
+    DB_GROUP.submit({"client_key": scan["client_key"], "student_number": sid_num, "action": None,
+                     "device_name": DEVICE_NAME, "timestamp": ts}).add_done_callback(_on_commit)
+    return done
 
-    return student_name, tipo
+def _complete_checkin(scan: dict, written):
+    """
+    Resto do check-in depois da escrita direta na BD: `written` é (checkins.id, students.id,
+    ação gravada), a exceção da escrita, ou None (não foi tentada: vai para o journal offline).
+    Devolve (nome, tipo), ou None se a BD recusou a leitura como repetida.
+    """
+    global _last_seen_checkin_id
+    sid_num, key, tipo, ts = scan["sid_num"], scan["key"], scan["tipo"], scan["ts"]
+    offline = written is None
+    if isinstance(written, CheckinCooldown):
+        logger.info(f"Leitura repetida ignorada (outro posto): {written}")
+        return None
+    if isinstance(written, BaseException):
+        if is_unavailable(written):
+            OFFLINE.mark_unhealthy(written)
+            offline = True
+        logger.warning(f"DB write skipped/failure: {written}")
+    elif written is not None:
+        OFFLINE.mark_healthy()
+        checkin_id, _, db_tipo = written
+        if db_tipo != tipo:
+            logger.info(f"Aluno {sid_num}: {tipo} corrigida para {db_tipo} pela BD (registo noutro posto)")
+            tipo = db_tipo
+        with _state_lock:
+            # sem buracos pelo meio -> o reconciliador não precisa de reler esta linha
+            if checkin_id == _last_seen_checkin_id + 1:
+                _last_seen_checkin_id = checkin_id
+            _applied_checkin_ids.add(checkin_id)
+    if offline:
+        OFFLINE.append(scan["client_key"], sid_num, tipo, DEVICE_NAME, ts)
+        logger.info(f"Check-in {scan['client_key']} guardado offline ({OFFLINE.pending_count()} por enviar à BD)")
+
+    # a linha escrita passa a ser o último estado conhecido deste aluno
+    with _state_lock:
+        last_scan_times[key] = {"last_scan": ts, "last_tipo": tipo}
+
+    # 2) Sinks (Sheets, CSV, cache, email) — assíncronos, cada um na sua fila;
+    #    a confirmação na UI só depende do passo 1.
+    formatted = ts.strftime("%d-%m-%y %H:%M:%S")
+    _fan_out({
+        "student_id": scan["student_id"], "key": key, "name": scan["name"], "tipo": tipo, "ts": ts,
+        "formatted": formatted, "email1": scan["email1"], "email2": scan["email2"],
+    })
+
+    logger.info(f"{tipo} registada: {scan['name']} ({scan['student_id']}) às {formatted}  "
+                f"in {time.time()-scan['start']:.3f}s")
+    return scan["name"], tipo
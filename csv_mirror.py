@@ -0,0 +1,106 @@
+# csv_mirror.py — espelho CSV diário (registos/registo_AAAA-MM-DD.csv) com ficheiro sempre aberto
+import os
+import csv
+import threading
+import logging
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+logger = logging.getLogger("app")
+
+HEADER = ["ID", "Nome", "Data", "Hora", "Ação"]
+
+
+class CsvMirror:
+    """
+    Mantém aberto o CSV do dia e escreve as linhas no buffer do ficheiro:
+      - write(): só um writerow em memória (microssegundos); flush ao disco no máximo
+        a cada `flush_interval` segundos ou quando há `max_buffer` linhas por escrever
+      - muda de ficheiro à meia-noite local (Europe/Lisbon), pela data de cada registo;
+        o thread de flush fecha também o ficheiro do dia anterior depois da meia-noite
+      - close(): flush final (chamar ao fechar a app)
+    """
+
+    def __init__(self, directory: str, flush_interval: float = 2.0, max_buffer: int = 50,
+                 tz: str = "Europe/Lisbon"):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.max_buffer = max(1, max_buffer)
+        self.tz = ZoneInfo(tz)
+
+        self._lock = threading.Lock()
+        self._day = None
+        self._fh = None
+        self._writer = None
+        self._unflushed = 0
+        self._closed = False
+
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="CsvMirror", daemon=True)
+        self._thread.start()
+
+    def path_for(self, day) -> str:
+        return os.path.join(self.directory, f"registo_{day}.csv")
+
+    def write(self, student_id, student_name: str, tipo: str, ts: datetime) -> None:
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("CsvMirror fechado")
+            if ts.date() != self._day:
+                self._open_day(ts.date())
+            self._writer.writerow([student_id, student_name, str(ts.date()), ts.strftime("%H:%M:%S"), tipo])
+            self._unflushed += 1
+            if self._unflushed >= self.max_buffer:
+                self._flush_locked()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_locked()
+
+    def close(self) -> None:
+        with self._lock:
+            self._close_file()
+            self._closed = True
+        self._wake.set()
+
+    # ---------- internos ----------
+    def _open_day(self, day) -> None:
+        self._close_file()
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path_for(day)
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._fh = open(path, "a", encoding="utf-8", newline="")
+        self._writer = csv.writer(self._fh)
+        if new:
+            self._writer.writerow(HEADER)
+            self._fh.flush()
+        self._day = day
+
+    def _flush_locked(self) -> None:
+        if self._fh is not None and self._unflushed:
+            try:
+                self._fh.flush()
+            except OSError as e:
+                logger.error(f"[CSV] flush falhou: {e}")
+                return
+            self._unflushed = 0
+
+    def _close_file(self) -> None:
+        if self._fh is not None:
+            self._flush_locked()
+            try:
+                self._fh.close()
+            except OSError:
+                pass
+        self._fh = self._writer = self._day = None
+
+    def _loop(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            with self._lock:
+                if self._closed:
+                    return
+                self._flush_locked()
+                # passou a meia-noite: fechar o ficheiro de ontem
+                if self._day is not None and datetime.now(self.tz).date() != self._day:
+                    self._close_file()
@@ -1,11 +1,14 @@
 # db.py — MariaDB helpers alinhados com o teu esquema
 from __future__ import annotations
 import os
+import functools
+import threading
+import time
 from pathlib import Path
 from typing import Optional
 import pymysql
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 
 
@@ -31,15 +34,293 @@ DB_PASS = os.getenv("DB_PASSWORD", "checkin_pass")
 DB_NAME = os.getenv("DB_NAME", "checkin_db")
 DEVICE  = os.getenv("MACHINE_NAME", None)  # Rececao / Piso 0
 
-def _connect():
+# Pool de ligações (evita um handshake TCP/auth por cada query)
+DB_POOL_SIZE      = int(os.getenv("DB_POOL_SIZE", "4") or "4")
+DB_POOL_TIMEOUT   = float(os.getenv("DB_POOL_TIMEOUT", "10") or "10")      # espera máx. por ligação livre
+DB_POOL_IDLE      = float(os.getenv("DB_POOL_IDLE", "300") or "300")       # fecha ligações paradas há mais de X s
+DB_POOL_PING      = float(os.getenv("DB_POOL_PING_AFTER", "2") or "2")     # ping no checkout se parada há mais de X s
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "5") or "5")
+DB_READ_TIMEOUT    = int(os.getenv("DB_READ_TIMEOUT", "30") or "30")
+DB_WRITE_TIMEOUT   = int(os.getenv("DB_WRITE_TIMEOUT", "30") or "30")
+
+DB_LOCK_RETRIES    = int(os.getenv("DB_LOCK_RETRIES", "3") or "3")         # deadlock/lock wait: repetir X vezes
+
+# erros que indicam que a ligação ficou inutilizável (não voltar ao pool): socket/pool
+# (InterfaceError, OSError — inclui o TimeoutError do pool esgotado) e, entre os
+# OperationalError, só os de ligação perdida. Deadlock, lock wait, etc. não contam.
+_BROKEN_ERRORS = (pymysql.err.InterfaceError, OSError)
+# CR_CONNECTION_ERROR, CR_CONN_HOST_ERROR, CR_SERVER_GONE_ERROR, CR_SERVER_LOST,
+# CR_SERVER_LOST_EXTENDED, ER_CON_COUNT_ERROR (too many connections)
+_CONNECTION_ERRNOS = (2002, 2003, 2006, 2013, 2055, 1040)
+
+# ER_LOCK_DEADLOCK, ER_LOCK_WAIT_TIMEOUT: a transação foi desfeita — repete-se aqui mesmo
+_LOCK_ERRNOS = (1213, 1205)
+
+# ER_BAD_FIELD_ERROR, ER_NO_SUCH_TABLE: a cache de esquema está desatualizada
+_SCHEMA_ERRNOS = (1054, 1146)
+
+
+def _mysql_errno(exc: BaseException):
+    args = getattr(exc, "args", None)
+    return args[0] if isinstance(exc, pymysql.err.MySQLError) and args and isinstance(args[0], int) else None
+
+
+def is_unavailable(exc: BaseException) -> bool:
+    """Erro de ligação/servidor (BD em baixo, pool esgotado) — por oposição a erro de dados."""
+    if isinstance(exc, _BROKEN_ERRORS):
+        return True
+    return isinstance(exc, pymysql.err.OperationalError) and _mysql_errno(exc) in _CONNECTION_ERRNOS
+
+
+def _retry_on_lock_conflict(func):
+    """
+    Repete a transação (até DB_LOCK_RETRIES vezes, com uma pequena pausa) se a BD a
+    desfizer por deadlock / lock wait timeout — p.ex. dois postos a bloquear os mesmos
+    alunos por ordens diferentes. A função tem de ser uma transação inteira.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(DB_LOCK_RETRIES + 1):
+            try:
+                return func(*args, **kwargs)
+            except pymysql.err.OperationalError as e:
+                if _mysql_errno(e) not in _LOCK_ERRNOS or attempt >= DB_LOCK_RETRIES:
+                    raise
+                time.sleep(0.05 * (2 ** attempt))
+    return wrapper
+
+
+class CheckinCooldown(Exception):
+    """Check-in recusado: o aluno já tem um registo a menos de `cooldown` segundos deste."""
+
+
+def _new_connection():
     return pymysql.connect(
         host=DB_HOST, port=DB_PORT, user=DB_USER, password=DB_PASS,
         database=DB_NAME, charset="utf8mb4",
         cursorclass=pymysql.cursors.DictCursor,
         autocommit=True,
+        connect_timeout=DB_CONNECT_TIMEOUT,
+        read_timeout=DB_READ_TIMEOUT,
+        write_timeout=DB_WRITE_TIMEOUT,
     )
 
+
+class _ConnectionPool:
+    """
+    Pool thread-safe de ligações PyMySQL.
+      - tamanho máximo DB_POOL_SIZE (quem exceder espera até DB_POOL_TIMEOUT)
+      - ping no checkout (se a ligação esteve parada) com religação automática
+      - ligações paradas há mais de DB_POOL_IDLE são fechadas
+      - reset() descarta tudo (ex.: mudança de definições no .env)
+    """
+
+    def __init__(self, size: int):
+        self.size = max(1, size)
+        self._cond = threading.Condition()
+        self._idle: list[tuple[object, float, int]] = []   # (conn, devolvida_em, geração)
+        self._in_use = 0
+        self._generation = 0
+        self._stats = {"checkouts": 0, "waits": 0, "reconnects": 0,
+                       "created": 0, "evicted": 0, "discarded": 0}
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _evict_idle(self, now: float) -> None:
+        keep = []
+        for conn, since, gen in self._idle:
+            if gen != self._generation or now - since > DB_POOL_IDLE:
+                self._close_quietly(conn)
+                self._stats["evicted"] += 1
+            else:
+                keep.append((conn, since, gen))
+        self._idle = keep
+
+    def acquire(self):
+        deadline = time.monotonic() + DB_POOL_TIMEOUT
+        with self._cond:
+            self._evict_idle(time.monotonic())
+            waited = False
+            while not self._idle and self._in_use >= self.size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"Pool da BD esgotado ({self.size} ligações em uso)")
+                if not waited:
+                    self._stats["waits"] += 1
+                    waited = True
+                self._cond.wait(remaining)
+            self._in_use += 1
+            self._stats["checkouts"] += 1
+            item = self._idle.pop() if self._idle else None
+            gen = self._generation
+
+        try:
+            if item is None:
+                conn = _new_connection()
+                with self._cond:
+                    self._stats["created"] += 1
+                return conn, gen
+            conn, since, _ = item
+            if time.monotonic() - since > DB_POOL_PING:
+                try:
+                    conn.ping(reconnect=False)
+                except Exception:
+                    self._close_quietly(conn)
+                    conn = _new_connection()
+                    with self._cond:
+                        self._stats["reconnects"] += 1
+            return conn, gen
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn, gen: int, broken: bool = False) -> None:
+        with self._cond:
+            self._in_use -= 1
+            if broken or gen != self._generation or not getattr(conn, "open", False):
+                self._stats["discarded"] += 1
+                self._close_quietly(conn)
+            else:
+                self._idle.append((conn, time.monotonic(), gen))
+            self._cond.notify()
+
+    def reset(self) -> None:
+        """Fecha as ligações livres; as que estão em uso são descartadas ao devolver."""
+        with self._cond:
+            self._generation += 1
+            for conn, _, _ in self._idle:
+                self._close_quietly(conn)
+            self._idle = []
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {**self._stats, "size": self.size,
+                    "in_use": self._in_use, "idle": len(self._idle)}
+
+
+class _PooledConnection:
+    """
+    Context manager devolvido por _connect(): empresta uma ligação do pool e
+    devolve-a no fim do bloco `with` (em vez de a fechar).
+    """
+
+    def __init__(self, pool: _ConnectionPool):
+        self._pool = pool
+        self._conn = None
+        self._gen = 0
+
+    def __enter__(self):
+        self._conn, self._gen = self._pool.acquire()
+        return self._conn
+
+    def __exit__(self, exc_type, exc, tb):
+        conn, self._conn = self._conn, None
+        if exc is not None and _mysql_errno(exc) in _SCHEMA_ERRNOS:
+            # coluna/tabela desconhecida: o esquema mudou (migração noutro posto) -> reler
+            invalidate_schema_cache()
+        broken = exc is not None and is_unavailable(exc)
+        if exc is not None and not broken:
+            # transação a meio? desfaz antes de devolver ao pool
+            try:
+                conn.rollback()
+            except Exception:
+                broken = True
+        self._pool.release(conn, self._gen, broken=broken)
+        return False
+
+
+_POOL = _ConnectionPool(DB_POOL_SIZE)
+
+
+def _connect():
+    """Ligação do pool — usar sempre como `with _connect() as conn:`."""
+    return _PooledConnection(_POOL)
+
+
+def pool_stats() -> dict:
+    """Contadores do pool (checkouts, waits, reconnects, …) para diagnóstico em runtime."""
+    return _POOL.stats()
+
+
+def reset_pool() -> None:
+    """Descarta as ligações atuais; as próximas usam DB_HOST/DB_USER/… em vigor."""
+    _POOL.reset()
+
+# ---------- SCHEMA (capacidades, cache por processo) ----------
+_SCHEMA_TABLES = ("students", "checkins", "student_last_checkin")
+_schema_cache: dict[str, frozenset] | None = None
+_schema_lock = threading.Lock()
+
+
+def _schema(cur) -> dict[str, frozenset]:
+    """
+    Colunas de students/checkins, lidas do INFORMATION_SCHEMA UMA vez por processo
+    (numa só query) e reutilizadas por todos os helpers.
+    """
+    global _schema_cache
+    cached = _schema_cache
+    if cached is not None:
+        return cached
+    with _schema_lock:
+        if _schema_cache is None:
+            placeholders = ", ".join(["%s"] * len(_SCHEMA_TABLES))
+            cur.execute(
+                "SELECT TABLE_NAME, COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS "
+                f"WHERE TABLE_SCHEMA=%s AND TABLE_NAME IN ({placeholders})",
+                (DB_NAME, *_SCHEMA_TABLES)
+            )
+            cols: dict[str, set] = {t: set() for t in _SCHEMA_TABLES}
+            for row in cur.fetchall():
+                cols.setdefault(row["TABLE_NAME"], set()).add(row["COLUMN_NAME"])
+            _schema_cache = {t: frozenset(c) for t, c in cols.items()}
+        return _schema_cache
+
+
+def _has_column(cur, table: str, column: str) -> bool:
+    return column in _schema(cur).get(table, frozenset())
+
+
+def _has_table(cur, table: str) -> bool:
+    return bool(_schema(cur).get(table))
+
+
+def schema_columns(table: str) -> frozenset:
+    """Colunas conhecidas da tabela (usa a cache; só vai à BD na 1.ª vez)."""
+    cached = _schema_cache
+    if cached is None:
+        with _connect() as conn, conn.cursor() as cur:
+            cached = _schema(cur)
+    return cached.get(table, frozenset())
+
+
+def invalidate_schema_cache() -> None:
+    """Esquece as colunas em cache (após migrações ou mudança de BD no .env)."""
+    global _schema_cache
+    with _schema_lock:
+        _schema_cache = None
+
 # ---------- STUDENTS ----------
+# Quem guarda alunos em memória (ex.: StudentDirectory) regista-se aqui para ser
+# avisado logo que um aluno muda na BD através destes helpers.
+_student_listeners: list = []
+
+def on_student_changed(callback) -> None:
+    """Regista callback(student_number) chamado após upsert/update/delete de um aluno."""
+    _student_listeners.append(callback)
+
+def _notify_student_changed(student_number: int) -> None:
+    for cb in list(_student_listeners):
+        try:
+            cb(int(student_number))
+        except Exception as e:
+            print(f"[BD] listener de alunos falhou: {e}")
+
 def upsert_student(student_number: int, name: str,
                    email1: str | None = None, email2: str | None = None,
                    qr_png: bytes | None = None) -> int:
@@ -59,20 +340,10 @@ def upsert_student(student_number: int, name: str,
             if email1 is not None: cols.append("email1"); vals.append(email1)
             if email2 is not None: cols.append("email2"); vals.append(email2)
             # qr_code é opcional — só guarda se vier bytes e a coluna existir
-            cur.execute(
-                "SELECT COUNT(*) AS c FROM INFORMATION_SCHEMA.COLUMNS "
-                "WHERE TABLE_SCHEMA=%s AND TABLE_NAME='students' AND COLUMN_NAME='qr_code'",
-                (DB_NAME,)
-            )
-            if (cur.fetchone() or {}).get("c", 0) > 0 and qr_png is not None:
+            if qr_png is not None and _has_column(cur, "students", "qr_code"):
                 cols.append("qr_code"); vals.append(qr_png)
             # status default 'Saída' se existir a coluna
-            cur.execute(
-                "SELECT COUNT(*) AS c FROM INFORMATION_SCHEMA.COLUMNS "
-                "WHERE TABLE_SCHEMA=%s AND TABLE_NAME='students' AND COLUMN_NAME='status'",
-                (DB_NAME,)
-            )
-            if (cur.fetchone() or {}).get("c", 0) > 0:
+            if _has_column(cur, "students", "status"):
                 cols.append("status"); vals.append("Saída")
 
             placeholders = ", ".join(["%s"] * len(vals))
@@ -80,23 +351,19 @@ def upsert_student(student_number: int, name: str,
             # obter id
             cur.execute("SELECT id FROM students WHERE student_number=%s", (student_number,))
             rid = cur.fetchone()
+            _notify_student_changed(student_number)
             return int(rid["id"]) if rid else 0
         else:
             # UPDATE
             sets, vals = ["name=%s"], [name]
             if email1 is not None: sets.append("email1=%s"); vals.append(email1)
             if email2 is not None: sets.append("email2=%s"); vals.append(email2)
-            if qr_png is not None:
-                # só atualiza se a coluna existir
-                cur.execute(
-                    "SELECT COUNT(*) AS c FROM INFORMATION_SCHEMA.COLUMNS "
-                    "WHERE TABLE_SCHEMA=%s AND TABLE_NAME='students' AND COLUMN_NAME='qr_code'",
-                    (DB_NAME,)
-                )
-                if (cur.fetchone() or {}).get("c", 0) > 0:
-                    sets.append("qr_code=%s"); vals.append(qr_png)
+            # qr_code só atualiza se a coluna existir
+            if qr_png is not None and _has_column(cur, "students", "qr_code"):
+                sets.append("qr_code=%s"); vals.append(qr_png)
             vals.append(student_number)
             cur.execute(f"UPDATE students SET {', '.join(sets)} WHERE student_number=%s", vals)
+            _notify_student_changed(student_number)
             return int(row["id"])
 
 def save_qr_image(student_number: int, qr_png: bytes) -> None:
@@ -104,84 +371,446 @@ def save_qr_image(student_number: int, qr_png: bytes) -> None:
     if not qr_png:
         return
     with _connect() as conn, conn.cursor() as cur:
-        cur.execute(
-            "SELECT COUNT(*) AS c FROM INFORMATION_SCHEMA.COLUMNS "
-            "WHERE TABLE_SCHEMA=%s AND TABLE_NAME='students' AND COLUMN_NAME='qr_code'",
-            (DB_NAME,)
-        )
-        if (cur.fetchone() or {}).get("c", 0) == 0:
+        if not _has_column(cur, "students", "qr_code"):
             return
         cur.execute(
             "UPDATE students SET qr_code=%s WHERE student_number=%s",
             (qr_png, student_number)
         )
 
-# db.py — corrige get_student_by_number para PyMySQL
+# Campos "leves" do aluno — o qr_code (LONGBLOB) fica de fora do caminho de leitura
+STUDENT_FIELDS = ("id", "student_number", "name", "email1", "email2", "status", "active")
 
-def get_student_by_number(student_number: int) -> dict | None:
-    # Já tens DictCursor definido na conexão, portanto basta cursor() simples
+def _student_select_list(cur, fields) -> str:
+    cols = _schema(cur)["students"]
+    out = []
+    for f in fields:
+        if not str(f).isidentifier():
+            raise ValueError(f"Campo inválido: {f!r}")
+        # coluna inexistente neste esquema -> NULL (mantém o dict com as mesmas chaves)
+        out.append(f"`{f}`" if f in cols else f"NULL AS `{f}`")
+    return ", ".join(out)
+
+def get_student_by_number(student_number: int, fields=STUDENT_FIELDS) -> dict | None:
+    """
+    Lê só as colunas pedidas (por omissão STUDENT_FIELDS, sem o BLOB do QR).
+    Para o QR usar get_student_qr().
+    """
     with _connect() as conn, conn.cursor() as cur:
         cur.execute(
-            "SELECT * FROM students WHERE student_number = %s",
+            f"SELECT {_student_select_list(cur, fields)} FROM students WHERE student_number = %s",
             (student_number,)
         )
-        # Em PyMySQL, para ver a query executada:
-        try:
-            print("Query executada:", cur._last_executed)
-        except Exception:
-            pass
+        return cur.fetchone()
+
+def get_student_qr(student_number: int) -> bytes | None:
+    """Lê o BLOB qr_code do aluno (só quando é mesmo preciso mostrar/guardar o QR)."""
+    with _connect() as conn, conn.cursor() as cur:
+        if not _has_column(cur, "students", "qr_code"):
+            return None
+        cur.execute("SELECT qr_code FROM students WHERE student_number=%s", (student_number,))
         row = cur.fetchone()
-        #print("Resultado:", row)
-        return row
+        return (row or {}).get("qr_code") or None
 
 
 # ---------- CHECKINS ----------
-def log_event(student_number: int, action: str, device_name: str | None = None, ts=None) -> None:
+# student_last_checkin: último registo por aluno, mantido na mesma transação de cada
+# check-in (migração 3). Só substitui se o registo novo não for mais antigo.
+_LAST_CHECKIN_UPSERT = (
+    "ON DUPLICATE KEY UPDATE "
+    "checkin_id  = IF(VALUES(timestamp) >= student_last_checkin.timestamp, VALUES(checkin_id),  student_last_checkin.checkin_id), "
+    "action      = IF(VALUES(timestamp) >= student_last_checkin.timestamp, VALUES(action),      student_last_checkin.action), "
+    "device_name = IF(VALUES(timestamp) >= student_last_checkin.timestamp, VALUES(device_name), student_last_checkin.device_name), "
+    "timestamp   = GREATEST(student_last_checkin.timestamp, VALUES(timestamp))"
+)
+
+# backfill (migração 3 e `python migrations.py --backfill-last`)
+LAST_CHECKIN_BACKFILL_SQL = (
+    "INSERT INTO student_last_checkin (student_id, checkin_id, action, timestamp, device_name) "
+    "SELECT c.student_id, c.id, c.action, c.timestamp, c.device_name "
+    "FROM checkins c "
+    "JOIN (SELECT student_id, MAX(timestamp) AS last_ts FROM checkins GROUP BY student_id) m "
+    "  ON m.student_id = c.student_id AND m.last_ts = c.timestamp "
+    "ORDER BY c.id " + _LAST_CHECKIN_UPSERT
+)
+
+
+def last_checkin_source(cur) -> str:
+    """
+    Fonte SQL (student_id, checkin_id, action, timestamp) com o último registo por aluno:
+    a tabela student_last_checkin se existir, senão o agregado MAX(timestamp) sobre checkins.
+    """
+    if _has_table(cur, "student_last_checkin"):
+        return "student_last_checkin"
+    return (
+        "(SELECT c1.student_id, c1.id AS checkin_id, c1.action, c1.timestamp "
+        " FROM checkins c1 "
+        " JOIN (SELECT student_id, MAX(timestamp) AS last_ts FROM checkins GROUP BY student_id) m1 "
+        "   ON m1.student_id = c1.student_id AND m1.last_ts = c1.timestamp)"
+    )
+
+
+def backfill_last_checkin() -> int:
+    """Reconstrói student_last_checkin a partir do histórico. Devolve linhas afetadas."""
+    with _connect() as conn, conn.cursor() as cur:
+        cur.execute(LAST_CHECKIN_BACKFILL_SQL)
+        return cur.rowcount
+
+def _next_action(prev_action: str | None) -> str:
+    return "Saída" if prev_action == "Entrada" else "Entrada"
+
+def _last_actions(cur, student_ids: list[int], day=None) -> dict[int, str]:
+    """
+    students.id -> ação do último registo (tabela de estado, ou o histórico sem migração 3).
+    Com `day`, uma 'Entrada' de antes desse dia conta como 'Saída': é a que o logout
+    automático (auto_logout_stale_entries) lhe dá, mesmo que ainda não tenha corrido.
+    """
+    if not student_ids:
+        return {}
+    marks = ", ".join(["%s"] * len(student_ids))
+    if _has_table(cur, "student_last_checkin"):
+        cur.execute(f"SELECT student_id, action, timestamp FROM student_last_checkin "
+                    f"WHERE student_id IN ({marks})", student_ids)
+    else:
+        cur.execute(f"SELECT student_id, action, timestamp FROM {last_checkin_source(cur)} l "
+                    f"WHERE l.student_id IN ({marks})", student_ids)
+    out = {}
+    for r in cur.fetchall():
+        action = r["action"]
+        if day is not None and action == "Entrada" and r["timestamp"].date() < day:
+            action = "Saída"
+        out[int(r["student_id"])] = action
+    return out
+
+def record_checkin(student_number: int, action: str, device_name: str | None = None,
+                   ts=None, client_key: str | None = None, cooldown: int = 0) -> tuple[int, int]:
+    """
+    Regista o check-in e atualiza students.status numa única transação:
+      1) INSERT … SELECT em checkins, resolvendo o aluno pelo student_number
+      2) UPDATE students.status (id=LAST_INSERT_ID(id) devolve o students.id sem SELECT extra)
+    Devolve (checkins.id, students.id). Não cria alunos: ValueError se não existir.
+    Com `client_key` (e a coluna checkins.client_key, migração 4) é idempotente: repetir a
+    mesma chave devolve o registo já existente sem inserir nem mexer no estado.
+    Com `cooldown` > 0 o INSERT só acontece se o aluno não tiver registo a menos de `cooldown`
+    segundos de `ts` (student_last_checkin, partilhada pelos vários postos); a linha do aluno
+    fica bloqueada (FOR UPDATE) até ao commit, por isso dois postos não passam ao mesmo tempo.
+    Recusado -> CheckinCooldown.
+    """
+    checkin_id, student_id, _ = _record_checkin(student_number, action, device_name, ts, client_key, cooldown)
+    return checkin_id, student_id
+
+def record_toggle_checkin(student_number: int, device_name: str | None = None, ts=None,
+                          client_key: str | None = None, cooldown: int = 0) -> tuple[int, int, str]:
+    """
+    Como record_checkin, mas a ação (Entrada/Saída) é decidida na BD: com a linha do aluno
+    bloqueada, o contrário do último registo dele — vale entre postos, sem esperar pelo
+    reconciliador. Devolve (checkins.id, students.id, ação gravada).
+    """
+    return _record_checkin(student_number, None, device_name, ts, client_key, cooldown)
+
+@_retry_on_lock_conflict
+def _record_checkin(student_number: int, action: str | None, device_name: str | None,
+                    ts, client_key: str | None, cooldown: int) -> tuple[int, int, str]:
     if ts is None:
         ts = datetime.now(ZoneInfo("Europe/Lisbon")).replace(tzinfo=None)
 
     with _connect() as conn, conn.cursor() as cur:
-        #print("STEP 1", student_number)
-        cur.execute("SELECT id FROM students WHERE student_number=%s", (student_number,))
+        has_device = _has_column(cur, "checkins", "device_name")
+        has_status = _has_column(cur, "students", "status")
+        use_key = client_key is not None and _has_column(cur, "checkins", "client_key")
 
-        r = cur.fetchone()
-        if r is None:
-            raise ValueError(f"Aluno {student_number} não existe na BD")
+        where, where_params = "student_number=%s", [student_number]
+        if cooldown > 0:
+            # último registo (tabela de estado, ou o histórico se ainda não houver migração 3)
+            last = "student_last_checkin" if _has_table(cur, "student_last_checkin") else "checkins"
+            where += (f" AND NOT EXISTS (SELECT 1 FROM {last} l WHERE l.student_id = students.id"
+                      f" AND l.timestamp > %s AND l.timestamp < %s)")
+            window = timedelta(seconds=cooldown)
+            where_params += [ts - window, ts + window]
 
-        sid = int(r["id"])
+        conn.begin()
+        locked = None
+        if cooldown > 0 or action is None:
+            cur.execute("SELECT id FROM students WHERE student_number=%s FOR UPDATE", (student_number,))
+            locked = cur.fetchone()
+            if locked is None:
+                conn.rollback()
+                raise ValueError(f"Aluno {student_number} não existe na BD")
+            if action is None:
+                sid = int(locked["id"])
+                action = _next_action(_last_actions(cur, [sid], ts.date()).get(sid))
+
+        cols, vals, params = ["student_id", "timestamp", "action"], ["id", "%s", "%s"], [ts, action]
+        if has_device:
+            cols.append("device_name"); vals.append("%s"); params.append(device_name or DEVICE)
+        if use_key:
+            cols.append("client_key"); vals.append("%s"); params.append(client_key)
 
-        #print("STEP 2", DB_NAME)
         cur.execute(
-            "SELECT COUNT(*) AS c FROM INFORMATION_SCHEMA.COLUMNS "
-            "WHERE TABLE_SCHEMA=%s AND TABLE_NAME='checkins' AND COLUMN_NAME='device_name'",
-            (DB_NAME,)
+            f"INSERT INTO checkins ({', '.join(cols)}) "
+            f"SELECT {', '.join(vals)} FROM students WHERE {where}"
+            # chave repetida: não insere; LAST_INSERT_ID(id) devolve o id do registo existente
+            + (" ON DUPLICATE KEY UPDATE checkins.id = LAST_INSERT_ID(checkins.id)" if use_key else ""),
+            params + where_params
         )
-        has_device = (cur.fetchone() or {}).get("c", 0) > 0
-        #print("has_device =", has_device)
+        if cur.rowcount != 1:
+            existing = int(cur.lastrowid or 0) if use_key else 0
+            if existing:
+                cur.execute("SELECT student_id, action FROM checkins WHERE id=%s", (existing,))
+                dup = cur.fetchone()
+                conn.commit()
+                return existing, int(dup["student_id"]), dup["action"]
+            if cooldown > 0 and locked:
+                if use_key:
+                    # a mesma chave já gravada (repetição após timeout) também cai no cooldown
+                    cur.execute("SELECT id, student_id, action FROM checkins WHERE client_key=%s", (client_key,))
+                    dup = cur.fetchone()
+                    if dup:
+                        conn.commit()
+                        return int(dup["id"]), int(dup["student_id"]), dup["action"]
+                conn.rollback()
+                raise CheckinCooldown(f"Aluno {student_number} já registado há menos de {cooldown}s")
+            conn.rollback()
+            raise ValueError(f"Aluno {student_number} não existe na BD")
+        checkin_id = int(cur.lastrowid)
+
+        if has_status:
+            cur.execute(
+                "UPDATE students SET status=%s, id=LAST_INSERT_ID(id) WHERE student_number=%s",
+                (action, student_number)
+            )
+        else:
+            cur.execute(
+                "UPDATE students SET id=LAST_INSERT_ID(id) WHERE student_number=%s",
+                (student_number,)
+            )
+        student_id = int(cur.lastrowid)
+
+        if _has_table(cur, "student_last_checkin"):
+            cur.execute(
+                "INSERT INTO student_last_checkin (student_id, checkin_id, action, timestamp, device_name) "
+                "VALUES (%s, %s, %s, %s, %s) " + _LAST_CHECKIN_UPSERT,
+                (student_id, checkin_id, action, ts, (device_name or DEVICE) if has_device else None)
+            )
+        conn.commit()
+
+    return checkin_id, student_id, action
+
+def auto_logout_stale_entries(device_name: str = "Logout Automático", ts=None) -> int:
+    """
+    Logout automático set-based, numa única transação:
+      1) UPDATE students.status='Saída' para quem não tem registo hoje (inclui quem nunca registou)
+      2) INSERT … SELECT de uma 'Saída' para cada aluno cujo último registo é 'Entrada' < hoje
+      3) student_last_checkin alinhada com as linhas inseridas (se a tabela existir)
+    Devolve o nº de saídas inseridas.
+    """
+    if ts is None:
+        ts = datetime.now(ZoneInfo("Europe/Lisbon")).replace(tzinfo=None)
+
+    with _connect() as conn, conn.cursor() as cur:
+        src = last_checkin_source(cur)
+        has_device = _has_column(cur, "checkins", "device_name")
+
+        conn.begin()
+        if _has_column(cur, "students", "status"):
+            cur.execute(f"""
+                UPDATE students s
+                LEFT JOIN {src} m ON m.student_id = s.id
+                SET s.status = 'Saída'
+                WHERE (s.status IS NULL OR s.status <> 'Saída') AND (m.timestamp IS NULL OR m.timestamp < CURDATE())
+            """)
 
         if has_device:
-            #print("STEP 3A", (sid, ts, action, device_name or DEVICE))
             cur.execute(
-                "INSERT INTO checkins (student_id, timestamp, action, device_name) VALUES (%s, %s, %s, %s)",
-                (sid, ts, action, device_name or DEVICE)
+                "INSERT INTO checkins (student_id, timestamp, action, device_name) "
+                f"SELECT l.student_id, %s, 'Saída', %s FROM {src} l "
+                "WHERE l.action = 'Entrada' AND l.timestamp < CURDATE()",
+                (ts, device_name)
             )
         else:
-            #print("STEP 3B", (sid, ts, action))
             cur.execute(
-                "INSERT INTO checkins (student_id, timestamp, action) VALUES (%s, %s, %s)",
-                (sid, ts, action)
+                "INSERT INTO checkins (student_id, timestamp, action) "
+                f"SELECT l.student_id, %s, 'Saída' FROM {src} l "
+                "WHERE l.action = 'Entrada' AND l.timestamp < CURDATE()",
+                (ts,)
             )
+        inserted = cur.rowcount
+
+        if inserted and _has_table(cur, "student_last_checkin"):
+            # lastrowid = id da 1.ª linha inserida por este INSERT … SELECT
+            cur.execute(
+                "INSERT INTO student_last_checkin (student_id, checkin_id, action, timestamp, device_name) "
+                f"SELECT student_id, id, action, timestamp, {'device_name' if has_device else 'NULL'} "
+                "FROM checkins WHERE id >= %s AND timestamp = %s AND action = 'Saída' "
+                + _LAST_CHECKIN_UPSERT,
+                (int(cur.lastrowid), ts)
+            )
+        conn.commit()
+
+    return inserted
 
-        #print("STEP 4", DB_NAME)
+def log_event(student_number: int, action: str, device_name: str | None = None, ts=None,
+              client_key: str | None = None, cooldown: int = 0) -> tuple[int, int]:
+    """Compat: delega para record_checkin; devolve (checkins.id, students.id)."""
+    return record_checkin(student_number, action, device_name, ts, client_key, cooldown)
+
+def _insert_checkins_batch(cur, rows: list[dict], cooldown: int = 0) -> int:
+    """
+    Corpo de record_checkins_batch, numa transação já aberta. Com `cooldown` > 0 cada linha
+    só entra se o aluno não tiver registo a menos de `cooldown` s dela (como em record_checkin).
+    """
+    has_device = _has_column(cur, "checkins", "device_name")
+    use_key = _has_column(cur, "checkins", "client_key")
+    values = " UNION ALL ".join(
+        ["SELECT %s AS seq, %s AS n, %s AS ts, %s AS action, %s AS dev, %s AS ck"] * len(rows))
+    params = []
+    for i, r in enumerate(rows):
+        params += [i, r["student_number"], r["timestamp"], r["action"], r.get("device_name") or DEVICE,
+                   r.get("client_key")]
+    numbers = sorted({int(r["student_number"]) for r in rows})
+
+    where = ""
+    if cooldown > 0:
+        last = "student_last_checkin" if _has_table(cur, "student_last_checkin") else "checkins"
+        where = (f" WHERE NOT EXISTS (SELECT 1 FROM {last} l WHERE l.student_id = s.id"
+                 f" AND l.timestamp > v.ts - INTERVAL %s SECOND AND l.timestamp < v.ts + INTERVAL %s SECOND)")
+        params += [int(cooldown), int(cooldown)]
+
+    cur.execute(
+        f"INSERT INTO checkins (student_id, timestamp, action{', device_name' if has_device else ''}"
+        f"{', client_key' if use_key else ''}) "
+        f"SELECT s.id, v.ts, v.action{', v.dev' if has_device else ''}{', v.ck' if use_key else ''} "
+        f"FROM ({values}) v JOIN students s ON s.student_number = v.n{where} "
+        "ORDER BY v.seq"
+        + (" ON DUPLICATE KEY UPDATE client_key = checkins.client_key" if use_key else ""),
+        params
+    )
+    inserted = cur.rowcount
+
+    if inserted and cur.lastrowid and _has_table(cur, "student_last_checkin"):
+        # lastrowid = id da 1.ª linha inserida; linhas de outros postos entretanto não fazem mal
+        # (o upsert só aceita registos mais recentes)
+        cur.execute(
+            "INSERT INTO student_last_checkin (student_id, checkin_id, action, timestamp, device_name) "
+            f"SELECT student_id, id, action, timestamp, {'device_name' if has_device else 'NULL'} "
+            "FROM checkins WHERE id >= %s ORDER BY id " + _LAST_CHECKIN_UPSERT,
+            (int(cur.lastrowid),)
+        )
+    if inserted and _has_column(cur, "students", "status"):
+        marks = ", ".join(["%s"] * len(numbers))
         cur.execute(
-            "SELECT COUNT(*) AS c FROM INFORMATION_SCHEMA.COLUMNS "
-            "WHERE TABLE_SCHEMA=%s AND TABLE_NAME='students' AND COLUMN_NAME='status'",
-            (DB_NAME,)
+            f"UPDATE students s JOIN {last_checkin_source(cur)} l ON l.student_id = s.id "
+            f"SET s.status = l.action WHERE s.student_number IN ({marks})",
+            numbers
         )
+    return inserted
+
+@_retry_on_lock_conflict
+def record_checkins_batch(rows: list[dict]) -> int:
+    """
+    Vários check-ins numa só transação (replay do journal offline):
+      1) um INSERT … SELECT multi-linha em checkins (alunos inexistentes são ignorados)
+      2) student_last_checkin com as linhas novas (upsert condicional: só avança no tempo)
+      3) students.status a partir do último registo dos alunos afetados
+    `rows`: dicts com student_number, action, device_name, timestamp (e client_key). Linhas cuja
+    client_key já está na BD são ignoradas, por isso o mesmo lote pode ser reenviado. Devolve o nº inserido.
+    """
+    if not rows:
+        return 0
+    with _connect() as conn, conn.cursor() as cur:
+        conn.begin()
+        inserted = _insert_checkins_batch(cur, rows)
+        conn.commit()
+    return inserted
 
-        if (cur.fetchone() or {}).get("c", 0) > 0:
-            #print("STEP 5", (action, sid))
-            cur.execute("UPDATE students SET status=%s WHERE id=%s", (action, sid))
+def record_checkins_group(rows: list[dict], cooldown: int = 0) -> list:
+    """
+    Group commit dos check-ins em direto: as linhas (com client_key) vão numa só transação,
+    como em record_checkins_batch, e devolve-se o resultado de cada uma, pela ordem de `rows`:
+    (checkins.id, students.id, ação gravada), ou a exceção que record_checkin levantaria para
+    essa linha (ValueError se o aluno não existe, CheckinCooldown). Os alunos do lote ficam
+    bloqueados (FOR UPDATE) até ao commit, para o cooldown e o toggle valerem entre postos.
+    Linha com "action": None -> Entrada/Saída decidida aqui, a partir do último registo do
+    aluno (como em record_toggle_checkin), por ordem dentro do lote.
+    Sem a coluna client_key (migração 4) não há como ligar ids às linhas: grava uma a uma.
+    """
+    if not rows:
+        return []
+    with _connect() as conn, conn.cursor() as cur:
+        group = _has_column(cur, "checkins", "client_key")
+    if not group:
+        out = []
+        for r in rows:
+            try:
+                out.append(_record_checkin(r["student_number"], r.get("action"), r.get("device_name"),
+                                           r["timestamp"], None, cooldown))
+            except (ValueError, CheckinCooldown) as e:
+                out.append(e)
+        return out
+    return _record_checkins_grouped(rows, cooldown)
+
+@_retry_on_lock_conflict
+def _record_checkins_grouped(rows: list[dict], cooldown: int) -> list:
+    """Corpo de record_checkins_group (com client_key): uma transação, repetível inteira."""
+    numbers = sorted({int(r["student_number"]) for r in rows})
+    keys = [r["client_key"] for r in rows]
+    rejected: dict[str, Exception] = {}
+    with _connect() as conn, conn.cursor() as cur:
+        conn.begin()
+        cur.execute(
+            f"SELECT id, student_number FROM students WHERE student_number IN ({', '.join(['%s'] * len(numbers))})"
+            + (" FOR UPDATE" if cooldown > 0 or any(r.get("action") is None for r in rows) else ""),
+            numbers
+        )
+        ids = {int(r["student_number"]): int(r["id"]) for r in cur.fetchall()}
+        last = _last_actions(cur, list(ids.values()), min(r["timestamp"] for r in rows).date())
+        prev = {n: last.get(i) for n, i in ids.items()}
+
+        # ação de cada linha e cooldown entre linhas do mesmo aluno dentro do lote
+        to_insert, last_ts = [], {}
+        for r in rows:
+            n = int(r["student_number"])
+            if n not in ids:
+                rejected[r["client_key"]] = ValueError(f"Aluno {n} não existe na BD")
+                continue
+            if cooldown > 0 and n in last_ts and abs((r["timestamp"] - last_ts[n]).total_seconds()) < cooldown:
+                rejected[r["client_key"]] = CheckinCooldown(f"Aluno {n} já registado há menos de {cooldown}s")
+                continue
+            action = r.get("action") or _next_action(prev.get(n))
+            prev[n], last_ts[n] = action, r["timestamp"]
+            to_insert.append({**r, "action": action})
+
+        if to_insert:
+            _insert_checkins_batch(cur, to_insert, cooldown)
+        # inseridas agora ou já existentes (a mesma client_key repetida) — a chave diz qual é qual
+        cur.execute(
+            f"SELECT id, student_id, action, client_key FROM checkins "
+            f"WHERE client_key IN ({', '.join(['%s'] * len(keys))})",
+            keys
+        )
+        found = {r["client_key"]: (int(r["id"]), int(r["student_id"]), r["action"]) for r in cur.fetchall()}
+        conn.commit()
+
+    out = []
+    for r in rows:
+        if r["client_key"] in found:
+            out.append(found[r["client_key"]])
+        elif r["client_key"] in rejected:
+            out.append(rejected[r["client_key"]])
+        else:
+            out.append(CheckinCooldown(f"Aluno {r['student_number']} já registado há menos de {cooldown}s"))
+    return out
+
+def fetch_checkins_since(after_id: int, limit: int = 5000) -> list[dict]:
+    """Registos com checkins.id > after_id (por ordem de id) — leitura pela PK, para reconciliação."""
+    with _connect() as conn, conn.cursor() as cur:
+        cur.execute(
+            "SELECT c.id, s.student_number, c.action, c.timestamp "
+            "FROM checkins c JOIN students s ON s.id = c.student_id "
+            "WHERE c.id > %s ORDER BY c.id ASC LIMIT %s",
+            (after_id, limit)
+        )
+        return cur.fetchall()
 
 # ---------- LISTAGEM (REGISTOS DE HOJE) ----------
 def fetch_today_checkins():
@@ -194,11 +823,7 @@ def fetch_today_checkins():
     """
     with _connect() as conn, conn.cursor() as cur:
         # detetar se checkins.device_name existe
-        cur.execute(
-            "SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS "
-            "WHERE TABLE_SCHEMA=%s AND TABLE_NAME='checkins'", (DB_NAME,)
-        )
-        cols = {row["COLUMN_NAME"] for row in cur.fetchall()}
+        cols = _schema(cur)["checkins"]
 
         select_fields = "c.timestamp, s.name, s.student_number, c.action"
         if "device_name" in cols:
@@ -218,42 +843,11 @@ def fetch_today_checkins():
         cur.execute(sql)
         return cur.fetchall()
 
-# --- Compat: write_checkin delega para log_event (aceita timestamp opcional) ---
-def write_checkin(student_number: int, student_name: str, action: str, ts=None, device_name: str | None = None) -> None:
-    # se vier timestamp, usa-o; senão, NOW()
-    if ts is None:
-        # manter política: não criar aluno automaticamente
-        return log_event(student_number, action, device_name)
-    with _connect() as conn, conn.cursor() as cur:
-        cur.execute("SELECT id FROM students WHERE student_number=%s", (student_number,))
-        r = cur.fetchone()
-        if r is None:
-            raise ValueError(f"Aluno {student_number} não existe na BD")
-        sid = int(r["id"])
-
-        # device_name opcional
-        cur.execute(
-            "SELECT COUNT(*) AS c FROM INFORMATION_SCHEMA.COLUMNS "
-            "WHERE TABLE_SCHEMA=%s AND TABLE_NAME='checkins' AND COLUMN_NAME='device_name'", (DB_NAME,)
-        )
-        has_device = (cur.fetchone() or {}).get("c", 0) > 0
-        if has_device:
-            cur.execute(
-                "INSERT INTO checkins (student_id, timestamp, action, device_name) VALUES (%s, %s, %s, %s)",
-                (sid, ts, action, device_name or DEVICE)
-            )
-        else:
-            cur.execute(
-                "INSERT INTO checkins (student_id, timestamp, action) VALUES (%s, %s, %s)",
-                (sid, ts, action)
-            )
-        # atualizar status se existir
-        cur.execute(
-            "SELECT COUNT(*) AS c FROM INFORMATION_SCHEMA.COLUMNS "
-            "WHERE TABLE_SCHEMA=%s AND TABLE_NAME='students' AND COLUMN_NAME='status'", (DB_NAME,)
-        )
-        if (cur.fetchone() or {}).get("c", 0) > 0:
-            cur.execute("UPDATE students SET status=%s WHERE id=%s", (action, sid))
+# --- Compat: write_checkin delega para record_checkin (aceita timestamp opcional) ---
+def write_checkin(student_number: int, student_name: str, action: str, ts=None,
+                  device_name: str | None = None, client_key: str | None = None) -> tuple[int, int]:
+    # se não vier timestamp, usa agora (Europe/Lisbon); não cria aluno automaticamente
+    return record_checkin(student_number, action, device_name, ts, client_key)
 
 # ---------- LISTA/EDIÇÃO/REMOÇÃO DE ALUNOS ----------
 def fetch_all_students(query: str | None = None, limit: int = 1000, offset: int = 0):
@@ -263,11 +857,7 @@ def fetch_all_students(query: str | None = None, limit: int = 1000, offset: int
     """
     with _connect() as conn, conn.cursor() as cur:
         # ver colunas disponíveis
-        cur.execute(
-            "SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS "
-            "WHERE TABLE_SCHEMA=%s AND TABLE_NAME='students'", (DB_NAME,)
-        )
-        cols = {row["COLUMN_NAME"] for row in cur.fetchall()}
+        cols = _schema(cur)["students"]
         # SELECT dinâmico conforme há email1/email2
         select_fields = ["id", "student_number", "name"]
         if "email1" in cols: select_fields.append("email1")
@@ -292,6 +882,19 @@ def fetch_all_students(query: str | None = None, limit: int = 1000, offset: int
         cur.execute(sql, params)
         return cur.fetchall()
 
+def fetch_student_directory(since_id: int = 0) -> list[dict]:
+    """
+    Campos leves (STUDENT_FIELDS) de todos os alunos com id > since_id, por ordem de id.
+    since_id=0 lê tudo; usado pelo StudentDirectory para carga inicial e incremental.
+    """
+    with _connect() as conn, conn.cursor() as cur:
+        cur.execute(
+            f"SELECT {_student_select_list(cur, STUDENT_FIELDS)} FROM students "
+            "WHERE id > %s ORDER BY id ASC",
+            (since_id,)
+        )
+        return cur.fetchall()
+
 def update_student_fields(student_number: int,
                           name: str | None = None,
                           email1: str | None = None,
@@ -301,11 +904,7 @@ def update_student_fields(student_number: int,
     Devolve número de linhas afetadas.
     """
     with _connect() as conn, conn.cursor() as cur:
-        cur.execute(
-            "SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS "
-            "WHERE TABLE_SCHEMA=%s AND TABLE_NAME='students'", (DB_NAME,)
-        )
-        cols = {row["COLUMN_NAME"] for row in cur.fetchall()}
+        cols = _schema(cur)["students"]
         sets, vals = [], []
         if name is not None and "name" in cols:
             sets.append("name=%s"); vals.append(name)
@@ -317,6 +916,7 @@ def update_student_fields(student_number: int,
             return 0
         vals.append(student_number)
         cur.execute(f"UPDATE students SET {', '.join(sets)} WHERE student_number=%s", vals)
+        _notify_student_changed(student_number)
         return cur.rowcount
 
 def delete_student(student_number: int) -> int:
@@ -341,12 +941,49 @@ def delete_student(student_number: int) -> int:
             """,
             (sid,)
         )
-
+        _notify_student_changed(student_number)
         return cur.rowcount
 
 # ---------- APAGAR REGISTO (checkin) ----------
 def delete_checkin(checkin_id: int) -> int:
-    """Apaga um registo (linha) da tabela checkins pelo seu id."""
+    """
+    Apaga um registo (linha) da tabela checkins pelo seu id. Na mesma transação, com a linha
+    do aluno bloqueada, o estado dele (student_last_checkin e students.status) passa a ser o
+    do registo anterior — o próximo scan alterna a partir desse, não do apagado.
+    """
     with _connect() as conn, conn.cursor() as cur:
+        has_last = _has_table(cur, "student_last_checkin")
+        has_status = _has_column(cur, "students", "status")
+        has_device = _has_column(cur, "checkins", "device_name")
+
+        conn.begin()
+        cur.execute("SELECT student_id FROM checkins WHERE id=%s", (checkin_id,))
+        row = cur.fetchone()
+        if row:
+            cur.execute("SELECT id FROM students WHERE id=%s FOR UPDATE", (row["student_id"],))
         cur.execute("DELETE FROM checkins WHERE id=%s", (checkin_id,))
-        return cur.rowcount
+        n = cur.rowcount
+        if row and n:
+            sid = int(row["student_id"])
+            cur.execute(
+                f"SELECT id, action, timestamp, {'device_name' if has_device else 'NULL AS device_name'} "
+                "FROM checkins WHERE student_id=%s ORDER BY timestamp DESC, id DESC LIMIT 1",
+                (sid,)
+            )
+            prev = cur.fetchone()
+            if has_last:
+                if prev:
+                    cur.execute(
+                        "INSERT INTO student_last_checkin (student_id, checkin_id, action, timestamp, device_name) "
+                        "VALUES (%s, %s, %s, %s, %s) "
+                        "ON DUPLICATE KEY UPDATE checkin_id = VALUES(checkin_id), action = VALUES(action), "
+                        "timestamp = VALUES(timestamp), device_name = VALUES(device_name)",
+                        (sid, prev["id"], prev["action"], prev["timestamp"], prev["device_name"])
+                    )
+                else:
+                    cur.execute("DELETE FROM student_last_checkin WHERE student_id=%s", (sid,))
+            if has_status:
+                cur.execute("UPDATE students SET status=%s WHERE id=%s",
+                            ((prev or {}).get("action") or "Saída", sid))
+        conn.commit()
+        return n
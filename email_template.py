@@ -0,0 +1,80 @@
+# email_template.py — templates HTML ({{nome}}, {{tipo}}, …) compilados uma vez e guardados em cache
+import os
+import re
+import threading
+import time
+import logging
+
+logger = logging.getLogger("app")
+
+_PLACEHOLDER = re.compile(r"\{\{\s*(\w+)\s*\}\}")
+
+
+class Template:
+    """Texto partido em [literal, nome, literal, nome, …]; render() é um único join."""
+
+    __slots__ = ("parts",)
+
+    def __init__(self, text: str):
+        self.parts = _PLACEHOLDER.split(text)   # índices ímpares = nomes dos placeholders
+
+    def render(self, values: dict) -> str:
+        parts = self.parts
+        out = parts[:]
+        for i in range(1, len(parts), 2):
+            out[i] = str(values.get(parts[i], ""))
+        return "".join(out)
+
+
+class TemplateCache:
+    """
+    path -> Template. Relê o ficheiro só quando o mtime/tamanho muda
+    (verificado no máximo a cada `check_interval` segundos por ficheiro).
+    """
+
+    def __init__(self, check_interval: float = 1.0):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._entries: dict[str, tuple[tuple, float, Template]] = {}   # path -> (stat, verificado_em, tpl)
+
+    def get(self, path: str) -> Template | None:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry and now - entry[1] < self.check_interval:
+            return entry[2]
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        sig = (st.st_mtime_ns, st.st_size)
+        if entry and entry[0] == sig:
+            tpl = entry[2]
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                tpl = Template(f.read())
+            if entry:
+                logger.info(f"[template] {os.path.basename(path)} alterado; recompilado")
+        with self._lock:
+            self._entries[path] = (sig, now, tpl)
+        return tpl
+
+    def render(self, path: str, values: dict, default: str | None = None) -> str | None:
+        """Render de `path`; se o ficheiro não existir/não ler, usa o template `default`."""
+        try:
+            tpl = self.get(path)
+        except Exception as e:
+            logger.error(f"Failed to read template {path}: {e}")
+            tpl = None
+        if tpl is None:
+            if default is None:
+                return None
+            tpl = Template(default)
+        return tpl.render(values)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+templates = TemplateCache()
@@ -4,10 +4,18 @@ import os, sys, json, re, base64, smtplib, mimetypes
 from pathlib import Path
 from typing import Any, Dict, Tuple, Optional
 from email.message import EmailMessage
+from html import escape
 
 import qrcode
 from qrcode.constants import ERROR_CORRECT_M
 
+from email_template import Template, templates
+
+_QR_EMAIL_DEFAULT = """<!doctype html><html><body>
+<p>Olá {{nome}},</p>
+<p>Segue em anexo o teu QR de acesso ({{escola}}).</p>
+</body></html>"""
+
 # -------------------- Defaults seguros --------------------
 DEFAULTS: Dict[str, Any] = {
     "qr_box_size": 10,
@@ -167,26 +175,22 @@ def enviar_qr_por_email(caminho_qr: str, nome: str, to_email: str | None = None)
     if not to:
         return
 
-    # corpo do email: tenta ler email.html (DATA_DIR ou APP_DIR), caso contrário usa um default simples
+    # corpo do email: email_qr.html (DATA_DIR ou APP_DIR) se existir, senão o corpo por omissão.
+    # (email.html é o aviso de check-in — {{tipo}}/{{hora}} — e não serve para o QR)
     data_dir = _cwd_dir()
     app_dir  = _exe_dir()
     email_tpl_candidates = [
-        data_dir / "email.html",
-        app_dir / "email.html",
+        data_dir / "email_qr.html",
+        app_dir / "email_qr.html",
     ]
     html = None
+    values = {"nome": escape(nome), "escola": escape(school)}
     for p in email_tpl_candidates:
-        if p.exists():
-            try:
-                html = p.read_text(encoding="utf-8")
-                break
-            except Exception:
-                pass
+        html = templates.render(str(p), values)
+        if html is not None:
+            break
     if html is None:
-        html = f"""<!doctype html><html><body>
-        <p>Olá {nome},</p>
-        <p>Segue em anexo o teu QR de acesso ({school}).</p>
-        </body></html>"""
+        html = Template(_QR_EMAIL_DEFAULT).render(values)
 
     subject = f"{school} – QR de acesso"
 
@@ -0,0 +1,123 @@
+# group_commit.py — junta check-ins em direto que chegam quase ao mesmo tempo numa só transação
+import threading
+import time
+import logging
+from concurrent.futures import Future
+
+logger = logging.getLogger("app")
+
+
+class GroupCommitter:
+    """
+    Group commit para a escrita na BD:
+      - submit(row) põe a linha na fila e devolve logo um Future, resolvido com o commit
+        do grupo dela (resultado dessa linha, ou a exceção dela) — quem submete não fica
+        bloqueado, por isso as linhas acumulam-se enquanto um commit está a decorrer
+      - o thread de commit grava logo que há linhas (sem espera se estiver parado); o que
+        chegar durante um commit vai no seguinte, até `max_rows`. `window_ms` > 0 junta
+        ainda mais à custa de latência: espera até esse tempo desde a 1.ª linha do grupo
+      - `write_batch(rows)` devolve um resultado por linha (um valor, ou uma exceção)
+      - o lote falhou inteiro: BD em baixo (`is_unavailable`) -> todas recebem o erro;
+        erro nos dados -> reenvia uma a uma para isolar a linha problemática
+      - close(timeout) grava o que ainda está na fila e pára o thread; um submit() depois
+        disso grava logo, no thread de quem chama
+    """
+
+    def __init__(self, write_batch, is_unavailable, window_ms: float = 0.0, max_rows: int = 50):
+        self._write_batch = write_batch
+        self._is_unavailable = is_unavailable
+        self.window = max(0.0, window_ms) / 1000.0
+        self.max_rows = max(1, max_rows)
+
+        self._cond = threading.Condition()
+        self._queue: list[tuple[dict, Future]] = []
+        self._thread = None
+        self._closed = False
+        self._stats = {"rows": 0, "groups": 0, "largest": 0, "last_commit_ms": None}
+
+    # ---------- API ----------
+    def submit(self, row: dict) -> Future:
+        fut = Future()
+        with self._cond:
+            if not self._closed:
+                self._queue.append((row, fut))
+                self._cond.notify()
+                return fut
+        self._commit([(row, fut)])
+        return fut
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {**self._stats, "queued": len(self._queue)}
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="GroupCommit", daemon=True)
+        self._thread.start()
+
+    def close(self, timeout: float = 10.0) -> bool:
+        """Deixa de juntar linhas e grava o grupo que falta. True se a fila ficou vazia."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        with self._cond:
+            return not self._queue and not (self._thread is not None and self._thread.is_alive())
+
+    # ---------- internos ----------
+    def _take_group(self) -> list[tuple[dict, Future]]:
+        """Próximo grupo a gravar; lista vazia depois de close() com a fila já vazia."""
+        with self._cond:
+            while not self._queue and not self._closed:
+                self._cond.wait()
+            deadline = time.monotonic() + self.window
+            while self.window and not self._closed and len(self._queue) < self.max_rows:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                self._cond.wait(left)
+            group, self._queue = self._queue[:self.max_rows], self._queue[self.max_rows:]
+        return group
+
+    def _commit(self, group: list[tuple[dict, Future]]) -> None:
+        rows = [row for row, _ in group]
+        t0 = time.monotonic()
+        try:
+            results = self._write_batch(rows)
+        except Exception as e:
+            if self._is_unavailable(e) or len(group) == 1:
+                for _, fut in group:
+                    fut.set_exception(e)
+                return
+            logger.warning(f"[group-commit] lote de {len(group)} rejeitado, a gravar um a um: {e!r}")
+            for item in group:
+                self._commit([item])
+            return
+
+        ms = (time.monotonic() - t0) * 1000.0
+        for (_, fut), res in zip(group, results):
+            if isinstance(res, BaseException):
+                fut.set_exception(res)
+            else:
+                fut.set_result(res)
+        with self._cond:
+            self._stats["rows"] += len(group)
+            self._stats["groups"] += 1
+            self._stats["largest"] = max(self._stats["largest"], len(group))
+            self._stats["last_commit_ms"] = round(ms, 1)
+        if len(group) > 1:
+            logger.info(f"[group-commit] {len(group)} check-ins numa transação em {ms:.0f} ms")
+
+    def _loop(self):
+        while True:
+            group = self._take_group()
+            if not group:
+                return
+            try:
+                self._commit(group)
+            except Exception as e:   # nunca deixar um Future por resolver
+                for _, fut in group:
+                    if not fut.done():
+                        fut.set_exception(e)
@@ -0,0 +1,212 @@
+# journal.py — journal append-only (JSON-lines) com offset de consumo e compactação em background
+import os
+import json
+import uuid
+import threading
+import logging
+
+logger = logging.getLogger("app")
+
+
+class Journal:
+    """
+    Fila persistente em disco, só de acrescento:
+      - append(record): uma linha JSON no fim do ficheiro; fsync em lote
+        (a cada `fsync_every` registos ou no máximo `fsync_interval` segundos depois)
+      - peek(limit): registos ainda por consumir + marca (nº de sequência) até onde vão
+      - commit(mark): marca como consumido até `mark` (o offset em bytes fica em <path>.offset)
+        — a marca não é uma posição no ficheiro, por isso continua válida mesmo que a
+        compactação reescreva o ficheiro entre o peek e o commit
+      - compactação em background: quando a parte já consumida passa de `compact_bytes`,
+        reescreve só o que falta consumir (ficheiro temporário + os.replace)
+
+    A 1.ª linha do ficheiro identifica-o ({"_journal": id}); o .offset guarda o mesmo id.
+    Se não baterem certo (crash a meio de uma compactação) o offset é ignorado e tudo o
+    que está no ficheiro conta como por consumir — nunca se perdem registos.
+    """
+
+    def __init__(self, path: str, fsync_every: int = 20, fsync_interval: float = 1.0,
+                 compact_bytes: int = 256 * 1024):
+        self.path = path
+        self.offset_path = path + ".offset"
+        self.fsync_every = max(1, fsync_every)
+        self.fsync_interval = fsync_interval
+        self.compact_bytes = compact_bytes
+
+        self._lock = threading.RLock()
+        self._pending: list[tuple[object, int, int]] = []   # (registo, fim da linha, nº de sequência)
+        self._seq = 0              # último nº de sequência atribuído (só em memória)
+        self._committed_seq = 0
+        self._unsynced = 0
+        self._file_id = None
+        self._offset = 0
+        self._fh = None
+        self._open()
+
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._background, name=f"Journal-{os.path.basename(path)}",
+                                        daemon=True)
+        self._thread.start()
+
+    # ---------- API ----------
+    def append(self, record) -> None:
+        line = (json.dumps(record, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+        with self._lock:
+            self._fh.write(line)
+            self._fh.flush()
+            self._seq += 1
+            self._pending.append((record, self._fh.tell(), self._seq))
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_every:
+                self._fsync()
+
+    def peek(self, limit: int | None = None) -> tuple[list, int]:
+        """Devolve (registos por consumir, marca para commit)."""
+        with self._lock:
+            items = self._pending if limit is None else self._pending[:limit]
+            if not items:
+                return [], self._committed_seq
+            return [rec for rec, _, _ in items], items[-1][2]
+
+    def commit(self, mark: int) -> None:
+        """Marca como consumido tudo até `mark` (valor devolvido por peek)."""
+        with self._lock:
+            if mark <= self._committed_seq:
+                return
+            n = 0
+            while n < len(self._pending) and self._pending[n][2] <= mark:
+                n += 1
+            self._committed_seq = mark
+            if not n:
+                return
+            # posição no ficheiro *atual* (pode ter sido compactado depois do peek)
+            self._offset = self._pending[n - 1][1]
+            del self._pending[:n]
+            self._write_offset()
+            if self._offset >= self.compact_bytes:
+                self._wake.set()
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def sync(self) -> None:
+        with self._lock:
+            self._fsync()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._fh:
+                self._fsync()
+                self._fh.close()
+                self._fh = None
+
+    # ---------- internos ----------
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            self._write_new_file(self.path, [])
+        saved_id, saved_offset = self._read_offset()
+
+        with open(self.path, "rb") as f:
+            data = f.read()
+        pos = 0
+        records = []
+        for raw in data.splitlines(keepends=True):
+            end = pos + len(raw)
+            if not raw.endswith(b"\n"):
+                # linha incompleta (crash a meio de uma escrita): descartar
+                logger.warning(f"[journal] {self.path}: linha final incompleta descartada")
+                data = data[:pos]
+                break
+            try:
+                rec = json.loads(raw.decode("utf-8"))
+            except Exception:
+                logger.warning(f"[journal] {self.path}: linha inválida ignorada em {pos}")
+                pos = end
+                continue
+            if pos == 0 and isinstance(rec, dict) and "_journal" in rec:
+                self._file_id = rec["_journal"]
+            else:
+                records.append((rec, end))
+            pos = end
+
+        if len(data) != os.path.getsize(self.path):
+            with open(self.path, "r+b") as f:
+                f.truncate(len(data))
+
+        self._offset = saved_offset if (saved_id and saved_id == self._file_id) else 0
+        self._pending = []
+        for rec, end in records:
+            if end > self._offset:
+                self._seq += 1
+                self._pending.append((rec, end, self._seq))
+        self._committed_seq = self._seq - len(self._pending)
+        self._fh = open(self.path, "ab")
+
+    def _read_offset(self):
+        try:
+            with open(self.offset_path, "r", encoding="utf-8") as f:
+                d = json.load(f)
+            return d.get("id"), int(d.get("offset", 0))
+        except Exception:
+            return None, 0
+
+    def _write_offset(self):
+        tmp = self.offset_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"id": self._file_id, "offset": self._offset}, f)
+        os.replace(tmp, self.offset_path)
+
+    def _write_new_file(self, target: str, records: list) -> int:
+        """Escreve cabeçalho + registos em `target` (via .tmp). Devolve o tamanho do cabeçalho."""
+        self._file_id = uuid.uuid4().hex
+        header = (json.dumps({"_journal": self._file_id}) + "\n").encode("utf-8")
+        tmp = target + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(header)
+            for rec in records:
+                f.write((json.dumps(rec, ensure_ascii=False, default=str) + "\n").encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, target)
+        return len(header)
+
+    def _fsync(self):
+        if self._fh and self._unsynced:
+            try:
+                os.fsync(self._fh.fileno())
+            except OSError as e:
+                logger.warning(f"[journal] fsync falhou em {self.path}: {e}")
+            self._unsynced = 0
+
+    def _compact(self):
+        with self._lock:
+            if self._offset < self.compact_bytes:
+                return
+            records = [(rec, seq) for rec, _, seq in self._pending]
+            self._fsync()
+            self._fh.close()
+            pos = self._write_new_file(self.path, [rec for rec, _ in records])
+            self._offset = pos
+            self._write_offset()
+            # recalcular posições no ficheiro novo (os nºs de sequência mantêm-se)
+            new_pending = []
+            for rec, seq in records:
+                pos += len((json.dumps(rec, ensure_ascii=False, default=str) + "\n").encode("utf-8"))
+                new_pending.append((rec, pos, seq))
+            self._pending = new_pending
+            self._fh = open(self.path, "ab")
+        logger.info(f"[journal] {os.path.basename(self.path)} compactado ({len(records)} por consumir)")
+
+    def _background(self):
+        while True:
+            self._wake.wait(self.fsync_interval)
+            self._wake.clear()
+            try:
+                with self._lock:
+                    self._fsync()
+                if self._offset >= self.compact_bytes:
+                    self._compact()
+            except Exception as e:
+                logger.error(f"[journal] manutenção falhou em {self.path}: {e}")
@@ -0,0 +1,118 @@
+# migrations.py — migrações versionadas do esquema (MariaDB)
+#
+# Uso:
+#   python migrations.py            aplica as migrações pendentes
+#   python migrations.py --status   lista versões aplicadas / pendentes
+#   python migrations.py --backfill-last   reconstrói student_last_checkin a partir do histórico
+#
+# A app chama apply_pending() no arranque. Cada migração é (versão, descrição, [SQL…]);
+# as versões aplicadas ficam na tabela schema_migrations. As instruções devem ser
+# idempotentes (IF NOT EXISTS), porque DDL em MariaDB faz commit implícito.
+from __future__ import annotations
+import sys
+
+import db
+
+MIGRATIONS_TABLE = "schema_migrations"
+_LOCK_NAME = "checkin_app_migrations"   # GET_LOCK: vários postos a arrancar ao mesmo tempo
+
+MIGRATIONS: list[tuple[int, str, list[str]]] = [
+    (1, "checkins: índice (student_id, timestamp) para último registo por aluno", [
+        "CREATE INDEX IF NOT EXISTS idx_checkins_student_ts ON checkins (student_id, timestamp)",
+    ]),
+    (2, "checkins: índice (timestamp) para registos de hoje", [
+        "CREATE INDEX IF NOT EXISTS idx_checkins_ts ON checkins (timestamp)",
+    ]),
+    (3, "student_last_checkin: último registo por aluno (+ backfill)", [
+        """
+        CREATE TABLE IF NOT EXISTS student_last_checkin (
+          student_id  INT(11)    NOT NULL,
+          checkin_id  BIGINT(20) NOT NULL,
+          action      ENUM('Entrada','Saída') NOT NULL,
+          timestamp   DATETIME   NOT NULL,
+          device_name VARCHAR(100) DEFAULT NULL,
+          PRIMARY KEY (student_id),
+          KEY idx_last_action_ts (action, timestamp),
+          CONSTRAINT fk_last_checkin_student FOREIGN KEY (student_id) REFERENCES students (id) ON DELETE CASCADE
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+        """,
+        db.LAST_CHECKIN_BACKFILL_SQL,
+    ]),
+    (4, "checkins.client_key: chave de idempotência gerada no posto (UNIQUE)", [
+        "ALTER TABLE checkins ADD COLUMN IF NOT EXISTS client_key VARCHAR(64) NULL DEFAULT NULL",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_checkins_client_key ON checkins (client_key)",
+    ]),
+]
+
+
+def _ensure_table(cur) -> None:
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} (
+          version     INT NOT NULL PRIMARY KEY,
+          description VARCHAR(255) NOT NULL,
+          applied_at  DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+
+
+def applied_versions() -> set[int]:
+    with db._connect() as conn, conn.cursor() as cur:
+        _ensure_table(cur)
+        cur.execute(f"SELECT version FROM {MIGRATIONS_TABLE}")
+        return {int(r["version"]) for r in cur.fetchall()}
+
+
+def pending() -> list[tuple[int, str, list[str]]]:
+    done = applied_versions()
+    return [m for m in sorted(MIGRATIONS) if m[0] not in done]
+
+
+def apply_pending() -> list[int]:
+    """Aplica (por ordem) as migrações em falta. Devolve as versões aplicadas agora."""
+    applied = []
+    with db._connect() as conn, conn.cursor() as cur:
+        _ensure_table(cur)
+        cur.execute("SELECT GET_LOCK(%s, 30) AS ok", (_LOCK_NAME,))
+        if not (cur.fetchone() or {}).get("ok"):
+            raise RuntimeError("Não foi possível obter o lock de migrações (outro posto a migrar?)")
+        # outro posto pode ter migrado depois de esta cache ser lida: reler sempre
+        db.invalidate_schema_cache()
+        try:
+            cur.execute(f"SELECT version FROM {MIGRATIONS_TABLE}")
+            done = {int(r["version"]) for r in cur.fetchall()}
+            for version, description, statements in sorted(MIGRATIONS):
+                if version in done:
+                    continue
+                print(f"[migrations] {version}: {description}")
+                for sql in statements:
+                    cur.execute(sql)
+                cur.execute(
+                    f"INSERT INTO {MIGRATIONS_TABLE} (version, description) VALUES (%s, %s)",
+                    (version, description)
+                )
+                applied.append(version)
+        finally:
+            cur.execute("SELECT RELEASE_LOCK(%s)", (_LOCK_NAME,))
+    if applied:
+        db.invalidate_schema_cache()
+    return applied
+
+
+def main(argv=None) -> int:
+    args = sys.argv[1:] if argv is None else argv
+    if "--backfill-last" in args:
+        print(f"[migrations] student_last_checkin: {db.backfill_last_checkin()} linha(s) afetadas")
+        return 0
+    if "--status" in args:
+        done = applied_versions()
+        for version, description, _ in sorted(MIGRATIONS):
+            mark = "x" if version in done else " "
+            print(f"[{mark}] {version:>3}  {description}")
+        return 0
+    applied = apply_pending()
+    print(f"[migrations] aplicadas: {applied or 'nenhuma (esquema atualizado)'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
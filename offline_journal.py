@@ -0,0 +1,221 @@
+# offline_journal.py — write-ahead journal dos check-ins em SQLite (DATA_DIR) + replay em lote para a BD
+import sqlite3
+import threading
+import time
+import logging
+from datetime import datetime
+
+from breaker import CLOSED
+
+logger = logging.getLogger("app")
+
+_TS_FMT = "%Y-%m-%d %H:%M:%S"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkin_journal (
+  client_key     TEXT PRIMARY KEY,
+  student_number INTEGER NOT NULL,
+  action         TEXT NOT NULL,
+  device_name    TEXT,
+  ts             TEXT NOT NULL,
+  created        REAL NOT NULL,
+  replayed_at    REAL,
+  attempts       INTEGER NOT NULL DEFAULT 0,
+  last_error     TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_journal_pending ON checkin_journal (created) WHERE replayed_at IS NULL;
+"""
+
+
+class OfflineJournal:
+    """
+    Check-ins aceites localmente quando a BD não responde (ou enquanto há backlog):
+      - append(): INSERT no SQLite (WAL) com a client_key como chave — instantâneo
+      - healthy: False depois de uma falha de ligação; o check-in seguinte já não tenta a BD.
+        Com `breaker` (breaker.CircuitBreaker) só quando o circuito abre (`failure_threshold`
+        falhas seguidas); o replay passa a testar a BD ao ritmo do cooloff do circuito
+      - thread de replay: envia o backlog por ordem, em lotes de `batch_size`, via
+        `push_batch(rows)` (db.record_checkins_batch) e marca as linhas como enviadas
+      - linhas enviadas há mais de `keep_days` dias são apagadas
+    `push_batch` recebe dicts com client_key, student_number, action, device_name, timestamp.
+    `is_unavailable(exc)` distingue BD em baixo (tenta mais tarde) de erro nos dados.
+    """
+
+    def __init__(self, path: str, push_batch, is_unavailable, batch_size: int = 200,
+                 retry_seconds: float = 15.0, keep_days: int = 7, breaker=None):
+        self.path = path
+        self._push_batch = push_batch
+        self._is_unavailable = is_unavailable
+        self._breaker = breaker
+        self._last_failure = None
+        self.batch_size = max(1, batch_size)
+        self.retry_seconds = retry_seconds
+        self.keep_days = keep_days
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=FULL")
+        self._db.executescript(_SCHEMA)
+        self._pending = self._count_pending()
+        self.healthy = self._pending == 0
+        self._wake = threading.Event()
+        self._thread = None
+        self._stats = {"journaled": 0, "replayed": 0, "skipped": 0, "last_replay_ms": None}
+        if self._pending:
+            logger.info(f"[offline] {self._pending} check-in(s) por enviar para a BD")
+
+    # ---------- API ----------
+    def append(self, client_key: str, student_number: int, action: str,
+               device_name: str | None, ts: datetime) -> None:
+        with self._lock:
+            cur = self._db.execute(
+                "INSERT OR IGNORE INTO checkin_journal (client_key, student_number, action, device_name, ts, created) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (client_key, int(student_number), action, device_name, ts.strftime(_TS_FMT), time.time())
+            )
+            # a mesma client_key outra vez (leitura já guardada) não conta como pendente nova
+            self._pending += cur.rowcount
+            self._stats["journaled"] += cur.rowcount
+        if self.healthy:
+            self._wake.set()   # com a BD em baixo espera pelo próximo retry_seconds
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return self._pending
+
+    @property
+    def accepting_direct(self) -> bool:
+        """True se um check-in pode ir direto à BD (BD saudável e sem backlog à frente dele)."""
+        with self._lock:
+            return self.healthy and self._pending == 0
+
+    def pending_entries(self) -> list[dict]:
+        """Check-ins ainda não enviados, por ordem (para sobrepor ao estado lido da BD)."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT student_number, action, ts FROM checkin_journal "
+                "WHERE replayed_at IS NULL ORDER BY created"
+            ).fetchall()
+        return [{"student_number": n, "action": a, "timestamp": datetime.strptime(ts, _TS_FMT)}
+                for n, a, ts in rows]
+
+    def mark_unhealthy(self, exc: BaseException | None = None) -> None:
+        """Falha de ligação à BD. Com breaker, só deixa de ir direto à BD com o circuito aberto."""
+        if self._breaker is not None:
+            if exc is None or exc is not self._last_failure:   # um grupo falhado conta uma vez
+                self._last_failure = exc
+                self._breaker.failure(exc)
+            if self._breaker.state == CLOSED:
+                self._wake.set()   # abaixo do limite: o replay tenta já o que ficou no journal
+                return
+        self.healthy = False
+
+    def mark_healthy(self) -> None:
+        """Escrita direta na BD correu bem (zera as falhas seguidas do breaker)."""
+        if self._breaker is not None:
+            self._breaker.success()
+
+    def wake(self) -> None:
+        """Tenta o replay já (p.ex. depois de corrigir as definições da BD)."""
+        self._wake.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "pending": self._pending, "healthy": self.healthy}
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="OfflineReplay", daemon=True)
+        self._thread.start()
+
+    def replay_once(self) -> int:
+        """Envia um lote do backlog. Devolve o nº de linhas tratadas (0 = nada pendente)."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT client_key, student_number, action, device_name, ts FROM checkin_journal "
+                "WHERE replayed_at IS NULL ORDER BY created LIMIT ?", (self.batch_size,)
+            ).fetchall()
+        if not rows:
+            with self._lock:
+                self._pending = self._count_pending()   # pode ter entrado um entretanto
+                if not self._pending:
+                    self.healthy = True
+                return self._pending
+        batch = [{"client_key": k, "student_number": n, "action": a, "device_name": d,
+                  "timestamp": datetime.strptime(ts, _TS_FMT)} for k, n, a, d, ts in rows]
+        keys = [r[0] for r in rows]
+        marks = ", ".join("?" * len(keys))
+
+        t0 = time.monotonic()
+        try:
+            inserted = self._push_batch(batch)
+        except Exception as e:
+            with self._lock:
+                self._db.execute(
+                    f"UPDATE checkin_journal SET attempts = attempts + 1, last_error = ? "
+                    f"WHERE client_key IN ({marks})", [repr(e)] + keys
+                )
+            if self._is_unavailable(e):
+                raise
+            # erro nos dados (não de ligação): reenviar um a um para isolar a linha problemática
+            if len(batch) == 1:
+                logger.error(f"[offline] check-in {keys[0]} rejeitado pela BD, ignorado: {e!r}")
+                inserted = 0
+            else:
+                for row in batch:
+                    try:
+                        self._push_batch([row])
+                    except Exception as e1:
+                        if self._is_unavailable(e1):
+                            raise
+                        logger.error(f"[offline] check-in {row['client_key']} rejeitado pela BD: {e1!r}")
+                    self._mark_replayed([row["client_key"]])
+                return len(batch)
+
+        self._mark_replayed(keys)
+        ms = (time.monotonic() - t0) * 1000.0
+        with self._lock:
+            self._stats["replayed"] += inserted
+            self._stats["skipped"] += len(batch) - inserted
+            self._stats["last_replay_ms"] = round(ms, 1)
+        logger.info(f"[offline] replay: {inserted}/{len(batch)} check-in(s) enviados em {ms:.0f} ms")
+        return len(batch)
+
+    # ---------- internos ----------
+    def _count_pending(self) -> int:
+        return self._db.execute("SELECT COUNT(DISTINCT client_key) FROM checkin_journal WHERE replayed_at IS NULL").fetchone()[0]
+
+    def _mark_replayed(self, keys: list[str]) -> None:
+        marks = ", ".join("?" * len(keys))
+        with self._lock:
+            self._db.execute(
+                f"UPDATE checkin_journal SET replayed_at = ? WHERE client_key IN ({marks}) AND replayed_at IS NULL",
+                [time.time()] + keys
+            )
+            self._pending = self._count_pending()
+
+    def _prune(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM checkin_journal WHERE replayed_at < ?",
+                             (time.time() - self.keep_days * 86400,))
+
+    def _loop(self):
+        last_prune = 0.0
+        while True:
+            self._wake.wait(self.retry_seconds)
+            self._wake.clear()
+            if not self.healthy and self._breaker is not None and not self._breaker.allow():
+                continue   # circuito aberto: só volta a testar a BD passado o cooloff
+            try:
+                while self.replay_once():
+                    pass
+                if self._breaker is not None:
+                    self._breaker.success()
+                if time.monotonic() - last_prune > 3600:
+                    self._prune()
+                    last_prune = time.monotonic()
+            except Exception as e:
+                self.mark_unhealthy(e)
+                logger.warning(f"[offline] BD indisponível; {self.pending_count()} check-in(s) em espera: {e!r}")
@@ -0,0 +1,214 @@
+# outbox.py — caixa de saída de emails em disco (DATA_DIR/outbox), enviada por um thread próprio
+import os
+import json
+import time
+import hashlib
+import smtplib
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger("app")
+
+
+def _is_server_level(e: Exception) -> bool:
+    """Falha que não é desta mensagem (ligação, login, servidor em baixo): afeta todas."""
+    return (not isinstance(e, smtplib.SMTPException)
+            or isinstance(e, (smtplib.SMTPServerDisconnected, smtplib.SMTPAuthenticationError,
+                              smtplib.SMTPConnectError)))
+
+
+def _is_permanent(e: Exception) -> bool:
+    """Erro 5xx / destinatário recusado: repetir não resolve -> vai logo para dead/."""
+    if _is_server_level(e):
+        return False
+    if isinstance(e, smtplib.SMTPRecipientsRefused):
+        return True
+    code = getattr(e, "smtp_code", None)
+    return isinstance(code, int) and 500 <= code < 600
+
+
+class Outbox:
+    """
+    Um ficheiro JSON por mensagem (um destinatário cada) em `directory`:
+      - enqueue(): grava a mensagem (tmp + os.replace) e acorda o sender — não fala com o SMTP
+      - dedup por destinatário: o id é hash(dedup_key); repetido enquanto está na caixa
+        ou entre os últimos enviados -> ignorado
+      - o thread sender chama `send(msg)`; em falha reagenda com backoff exponencial;
+        ao fim de `max_attempts` erros da própria mensagem (ou erro permanente) move para
+        `directory`/dead/
+      - erro de ligação/servidor adia a passagem toda (não gasta um timeout por mensagem)
+        e não conta como tentativa: uma falha longa do servidor não manda emails para dead/
+      - com `breaker` (breaker.CircuitBreaker) aberto não tenta o servidor: as mensagens
+        ficam na caixa, sem contar tentativas, até ao próximo teste
+      - depth(): mensagens por enviar
+    """
+
+    def __init__(self, directory: str, send, max_attempts: int = 8,
+                 backoff_base: float = 30.0, backoff_max: float = 3600.0, remember_sent: int = 2000,
+                 breaker=None):
+        self.directory = directory
+        self.dead_dir = os.path.join(directory, "dead")
+        self._send = send
+        self._breaker = breaker
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.remember_sent = remember_sent
+
+        os.makedirs(self.dead_dir, exist_ok=True)
+        self._cond = threading.Condition()
+        self._entries: dict[str, dict] = {}
+        self._recent_sent: OrderedDict[str, None] = OrderedDict()
+        self._stats = {"enqueued": 0, "sent": 0, "retries": 0, "dead": 0, "duplicates": 0}
+        self._server_failures = 0   # falhas de servidor seguidas (backoff da passagem)
+        self._thread = None
+        self._load()
+
+    # ---------- API ----------
+    def enqueue(self, to: str, subject: str, text: str, html: str | None, dedup_key: str) -> bool:
+        """Guarda a mensagem para envio. Devolve False se for repetida."""
+        msg_id = hashlib.sha1(f"{to.lower()}|{dedup_key}".encode("utf-8")).hexdigest()[:24]
+        entry = {
+            "id": msg_id, "to": to, "subject": subject, "text": text, "html": html,
+            "created": time.time(), "attempts": 0, "next_at": 0.0, "last_error": None,
+        }
+        with self._cond:
+            if msg_id in self._entries or msg_id in self._recent_sent:
+                self._stats["duplicates"] += 1
+                return False
+            self._write(entry)
+            self._entries[msg_id] = entry
+            self._stats["enqueued"] += 1
+            self._cond.notify()
+        return True
+
+    def depth(self) -> int:
+        with self._cond:
+            return len(self._entries)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {**self._stats, "depth": len(self._entries)}
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="Outbox", daemon=True)
+        self._thread.start()
+
+    def wake(self) -> None:
+        """Tenta já as mensagens em backoff (p.ex. depois de corrigir as definições SMTP)."""
+        with self._cond:
+            for e in self._entries.values():
+                e["next_at"] = 0.0
+            self._cond.notify()
+
+    # ---------- internos ----------
+    def _path(self, msg_id: str, dead: bool = False) -> str:
+        return os.path.join(self.dead_dir if dead else self.directory, f"{msg_id}.json")
+
+    def _write(self, entry: dict) -> None:
+        path = self._path(entry["id"])
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def _load(self) -> None:
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+                self._entries[entry["id"]] = entry
+            except Exception as e:
+                logger.error(f"[outbox] mensagem ilegível {name}: {e}")
+        if self._entries:
+            logger.info(f"[outbox] {len(self._entries)} email(s) por enviar")
+
+    def _due(self) -> tuple[list[dict], float]:
+        """(mensagens prontas por ordem de criação, segundos até à próxima)."""
+        now = time.time()
+        ready = sorted((e for e in self._entries.values() if e["next_at"] <= now),
+                       key=lambda e: e["created"])
+        later = [e["next_at"] - now for e in self._entries.values() if e["next_at"] > now]
+        return ready, (min(later) if later else 60.0)
+
+    def _on_sent(self, entry: dict) -> None:
+        with self._cond:
+            self._entries.pop(entry["id"], None)
+            self._recent_sent[entry["id"]] = None
+            while len(self._recent_sent) > self.remember_sent:
+                self._recent_sent.popitem(last=False)
+            self._stats["sent"] += 1
+        try:
+            os.remove(self._path(entry["id"]))
+        except FileNotFoundError:
+            pass
+
+    def _on_server_failure(self, ready: list[dict], e: Exception) -> None:
+        """Servidor inacessível: adia todas as mensagens da passagem, sem gastar tentativas."""
+        self._server_failures += 1
+        delay = min(self.backoff_max, self.backoff_base * (2 ** (self._server_failures - 1)))
+        retry_at = time.time() + delay
+        with self._cond:
+            for entry in ready:
+                if entry["next_at"] < retry_at:
+                    entry["next_at"] = retry_at
+            self._stats["retries"] += 1
+        ready[0]["last_error"] = repr(e)
+        self._write(ready[0])
+        logger.warning(f"[outbox] servidor indisponível; {len(ready)} email(s) adiados {delay:.0f}s: {e!r}")
+
+    def _on_failed(self, entry: dict, e: Exception) -> None:
+        entry["attempts"] += 1
+        entry["last_error"] = repr(e)
+        if _is_permanent(e) or entry["attempts"] >= self.max_attempts:
+            with self._cond:
+                self._entries.pop(entry["id"], None)
+                self._stats["dead"] += 1
+            self._write(entry)
+            os.replace(self._path(entry["id"]), self._path(entry["id"], dead=True))
+            logger.error(f"[outbox] desisti de {entry['to']} ({entry['attempts']} tentativa(s)): {e!r}")
+            return
+        delay = min(self.backoff_max, self.backoff_base * (2 ** (entry["attempts"] - 1)))
+        entry["next_at"] = time.time() + delay
+        with self._cond:
+            self._stats["retries"] += 1
+        self._write(entry)
+        logger.warning(f"[outbox] falha para {entry['to']} (tentativa {entry['attempts']}); "
+                       f"nova tentativa em {delay:.0f}s: {e!r}")
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                ready, wait = self._due()
+                if not ready:
+                    self._cond.wait(wait)
+                    continue
+            for entry in ready:
+                if self._breaker is not None and not self._breaker.allow():
+                    with self._cond:
+                        self._cond.wait(max(1.0, self._breaker.retry_in()))
+                    break
+                try:
+                    self._send(entry)
+                except Exception as e:
+                    if self._breaker is not None:
+                        if _is_server_level(e):
+                            self._breaker.failure(e)
+                        else:
+                            self._breaker.success()   # erro só desta mensagem: o servidor respondeu
+                    if _is_server_level(e):
+                        # servidor inacessível: esta e as restantes esperam pela próxima passagem
+                        self._on_server_failure(ready[ready.index(entry):], e)
+                        break
+                    self._server_failures = 0
+                    self._on_failed(entry, e)
+                    continue
+                if self._breaker is not None:
+                    self._breaker.success()
+                self._server_failures = 0
+                self._on_sent(entry)
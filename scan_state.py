@@ -0,0 +1,120 @@
+# scan_state.py — persistência incremental do estado Entrada/Saída (snapshot + log de alterações)
+import os
+import json
+import threading
+import logging
+from datetime import datetime
+
+logger = logging.getLogger("app")
+
+_TS_FMT = "%Y-%m-%d %H:%M:%S"
+
+
+class ScanStateStore:
+    """
+    Estado student_number -> {"last_scan": datetime, "last_tipo": str} em disco:
+      - snapshot (scan_cache.json): o dicionário completo, escrito via .tmp + os.replace
+      - log (scan_cache.log): uma linha JSON por alteração [sid, "AAAA-MM-DD HH:MM:SS", tipo]
+    record() só acrescenta uma linha (custo constante, independente do nº de alunos);
+    ao fim de `snapshot_every` linhas escreve-se um snapshot novo e o log recomeça.
+    No load() as linhas do log só se aplicam se forem mais recentes que o snapshot,
+    por isso um crash entre o snapshot e o truncar do log não repõe estado antigo.
+    `get_state` devolve uma cópia do estado atual (usada nos snapshots automáticos).
+    """
+
+    def __init__(self, snapshot_path: str, log_path: str, get_state,
+                 snapshot_every: int = 500, fsync_every: int = 20):
+        self.snapshot_path = snapshot_path
+        self.log_path = log_path
+        self._get_state = get_state
+        self.snapshot_every = max(1, snapshot_every)
+        self.fsync_every = max(1, fsync_every)
+
+        self._lock = threading.Lock()
+        self._fh = None
+        self._log_lines = 0
+        self._unsynced = 0
+
+    # ---------- leitura ----------
+    def load(self) -> dict:
+        state = {}
+        if os.path.exists(self.snapshot_path):
+            try:
+                with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                    for sid, info in (json.load(f) or {}).items():
+                        state[sid] = {
+                            "last_scan": datetime.strptime(info["last_scan"], _TS_FMT),
+                            "last_tipo": info["last_tipo"],
+                        }
+            except Exception as e:
+                logger.error(f"Failed to read cache {self.snapshot_path}: {e}")
+
+        base = {sid: info["last_scan"] for sid, info in state.items()}
+        lines = 0
+        if os.path.exists(self.log_path):
+            with open(self.log_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        sid, ts, tipo = json.loads(line)
+                        ts = datetime.strptime(ts, _TS_FMT)
+                    except Exception:
+                        continue   # linha incompleta (crash a meio de uma escrita)
+                    lines += 1
+                    if sid not in base or ts > base[sid]:
+                        state[sid] = {"last_scan": ts, "last_tipo": tipo}
+        with self._lock:
+            self._log_lines = lines
+        return state
+
+    # ---------- escrita ----------
+    def record(self, sid: str, last_scan: datetime, last_tipo: str) -> None:
+        """Acrescenta uma alteração ao log; faz snapshot automático quando o log cresce."""
+        line = json.dumps([str(sid), last_scan.strftime(_TS_FMT), last_tipo], ensure_ascii=False) + "\n"
+        with self._lock:
+            if self._fh is None:
+                self._fh = open(self.log_path, "a", encoding="utf-8")
+            self._fh.write(line)
+            self._fh.flush()
+            self._log_lines += 1
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_every:
+                self._fsync()
+            due = self._log_lines >= self.snapshot_every
+        if due:
+            self.snapshot()
+
+    def snapshot(self) -> None:
+        """Escreve o estado completo (atómico) e recomeça o log."""
+        with self._lock:
+            # cópia tirada com o lock: nenhum record() fica entre a cópia e o truncar do log
+            data = {
+                sid: {"last_scan": info["last_scan"].strftime(_TS_FMT), "last_tipo": info["last_tipo"]}
+                for sid, info in self._get_state().items()
+            }
+            tmp = self.snapshot_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.snapshot_path)
+            if self._fh is not None:
+                self._fh.close()
+            self._fh = open(self.log_path, "w", encoding="utf-8")
+            self._log_lines = 0
+            self._unsynced = 0
+        logger.debug(f"Cache snapshot: {len(data)} aluno(s)")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._fh is not None:
+                self._fsync()
+                self._fh.close()
+                self._fh = None
+
+    def _fsync(self):
+        if self._fh is not None and self._unsynced:
+            try:
+                os.fsync(self._fh.fileno())
+            except OSError as e:
+                logger.warning(f"[scan_state] fsync falhou: {e}")
+            self._unsynced = 0
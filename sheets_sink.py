@@ -0,0 +1,159 @@
+# sheets_sink.py — escrita em lote para o Google Sheets (append_rows + flush periódico)
+import threading
+import time
+import logging
+
+logger = logging.getLogger("app")
+
+
+def _is_quota_error(e: Exception) -> bool:
+    status = getattr(getattr(e, "response", None), "status_code", None)
+    text = str(e)
+    return status == 429 or "RESOURCE_EXHAUSTED" in text or "Quota exceeded" in text
+
+
+class SheetsSink:
+    """
+    Envia as linhas ao Sheets num único sheet.append_rows() por intervalo ou lote.
+      - cada linha vai primeiro para o journal de pendentes (append-only, sobrevive a crashes)
+      - o flush lê do offset do journal, pela ordem original, e só faz commit depois do append_rows
+      - numa falha o offset não avança; erro de quota -> backoff exponencial
+      - stats(): linhas em voo, latência do último flush, backoff
+    `get_sheet` devolve a worksheet (ou None se o Sheets estiver desativado);
+    `journal` é um journal.Journal (append / peek / commit / pending_count);
+    `breaker` (opcional, breaker.CircuitBreaker): com o circuito aberto nem tenta o append_rows.
+    """
+
+    def __init__(self, get_sheet, journal, interval: float = 5.0, batch_size: int = 50,
+                 max_rows: int = 500, backoff_base: float = 10.0, backoff_max: float = 600.0,
+                 breaker=None):
+        self._get_sheet = get_sheet
+        self._journal = journal
+        self._breaker = breaker
+        self.interval = interval
+        self.batch_size = max(1, batch_size)
+        self.max_rows = max(self.batch_size, max_rows)   # limite por pedido append_rows
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._cond = threading.Condition()
+        self._flush_requested = False
+        self._flush_lock = threading.Lock()       # um flush de cada vez (loop ou flush() explícito)
+        self._failures = 0
+        self._backoff_until = 0.0
+        self._stats = {"flushes": 0, "rows_sent": 0, "errors": 0,
+                       "last_flush_rows": 0, "last_flush_ms": None}
+
+        self._thread = threading.Thread(target=self._loop, name="SheetsSink", daemon=True)
+        self._thread.start()
+
+    # ---------- API ----------
+    def submit(self, row) -> None:
+        self._journal.append(row)
+        if self._journal.pending_count() >= self.batch_size:
+            with self._cond:
+                self._cond.notify()
+
+    def request_flush(self) -> None:
+        """Pede um flush ao thread do sink (não bloqueia)."""
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify()
+
+    def flush(self, force: bool = False) -> bool:
+        """
+        Envia as linhas pendentes do journal (em pedidos de até max_rows).
+        Devolve True se ficou tudo enviado. Durante o backoff não tenta (a não ser com force=True).
+        """
+        with self._flush_lock:
+            with self._cond:
+                self._flush_requested = False
+                in_backoff = time.monotonic() < self._backoff_until
+            while True:
+                rows, pos = self._journal.peek(self.max_rows)
+                if not rows:
+                    return True
+
+                sheet = self._get_sheet()
+                if sheet is None or (in_backoff and not force):
+                    # Sheets desativado/offline ou em backoff: ficam no journal para mais tarde
+                    if sheet is None:
+                        with self._cond:
+                            self._backoff_until = max(self._backoff_until, time.monotonic() + self.interval)
+                    return False
+                if self._breaker is not None and not force and not self._breaker.allow():
+                    # Sheets em baixo: ficam no journal até ao próximo teste do circuito (sem
+                    # isto o _loop, com um lote cheio pendente, voltava logo ao flush)
+                    with self._cond:
+                        self._backoff_until = max(self._backoff_until,
+                                                  time.monotonic() + max(self._breaker.retry_in(), self.interval))
+                    return False
+
+                t0 = time.monotonic()
+                try:
+                    sheet.append_rows(rows)
+                except Exception as e:
+                    if self._breaker is not None:
+                        self._breaker.failure(e)
+                    self._on_failure(e, len(rows))
+                    return False
+                if self._breaker is not None:
+                    self._breaker.success()
+
+                self._journal.commit(pos)
+                ms = (time.monotonic() - t0) * 1000.0
+                with self._cond:
+                    self._failures = 0
+                    self._backoff_until = 0.0
+                    self._stats["flushes"] += 1
+                    self._stats["rows_sent"] += len(rows)
+                    self._stats["last_flush_rows"] = len(rows)
+                    self._stats["last_flush_ms"] = round(ms, 1)
+                logger.info(f"Sheet append_rows OK: {len(rows)} linha(s) em {ms:.0f} ms")
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {**self._stats,
+                    "in_flight": self._journal.pending_count(),
+                    "backoff_s": max(0.0, round(self._backoff_until - time.monotonic(), 1))}
+
+    def close(self, timeout: float = 10.0) -> bool:
+        """Flush final (ao fechar a app)."""
+        done = threading.Event()
+        result = [False]
+
+        def _run():
+            try:
+                result[0] = self.flush(force=True)
+            finally:
+                done.set()
+
+        threading.Thread(target=_run, name="SheetsSink-close", daemon=True).start()
+        done.wait(timeout)
+        self._journal.sync()
+        return result[0]
+
+    # ---------- internos ----------
+    def _on_failure(self, e: Exception, n_rows: int) -> None:
+        with self._cond:
+            self._failures += 1
+            self._stats["errors"] += 1
+            base = self.backoff_base if _is_quota_error(e) else self.interval
+            delay = min(self.backoff_max, base * (2 ** (self._failures - 1)))
+            self._backoff_until = time.monotonic() + delay
+        logger.error(f"Sheet append_rows failed ({n_rows} linha(s)); kept in journal, retry in {delay:.0f}s: {e}")
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                # espera pelo intervalo (ou pelo fim do backoff), por um lote cheio ou por um pedido explícito
+                deadline = max(time.monotonic() + self.interval, self._backoff_until)
+                while not self._flush_requested and time.monotonic() < deadline:
+                    if (self._journal.pending_count() >= self.batch_size
+                            and time.monotonic() >= self._backoff_until):
+                        break
+                    self._cond.wait(max(0.0, deadline - time.monotonic()))
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"SheetsSink: flush falhou: {e}")
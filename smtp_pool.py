@@ -0,0 +1,216 @@
+# smtp_pool.py — sessões SMTP_SSL autenticadas reutilizadas entre emails (NOOP keepalive)
+import socket
+import ssl
+import smtplib
+import threading
+import time
+import logging
+
+logger = logging.getLogger("app")
+
+
+def _session_dead(e: Exception) -> bool:
+    """Sessão morta (timeout do servidor, ligação cortada, 421): reconectar e repetir."""
+    if isinstance(e, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(e, smtplib.SMTPResponseException):
+        return e.smtp_code == 421
+    if isinstance(e, smtplib.SMTPException):
+        return False   # destinatário recusado, etc.: reconectar não ajuda
+    return isinstance(e, OSError)
+
+
+class _Session:
+    __slots__ = ("smtp", "settings", "last_sent", "last_used", "utf8", "peer")
+
+    def __init__(self, smtp, settings, peer):
+        self.smtp = smtp
+        self.settings = settings
+        self.last_sent = self.last_used = time.monotonic()   # último envio / última atividade (NOOP incl.)
+        self.utf8 = smtp.has_extn("smtputf8")
+        self.peer = peer
+
+    def close(self):
+        try:
+            self.smtp.quit()
+        except Exception:
+            try:
+                self.smtp.close()
+            except Exception:
+                pass
+
+
+class SmtpPool:
+    """
+    Gestor de sessões SMTP_SSL já autenticadas:
+      - send(msg): usa uma sessão livre (ou abre uma) — por email só MAIL/RCPT/DATA
+      - sessões paradas há mais de `keepalive` s levam um NOOP antes de serem usadas;
+        o thread de keepalive faz o mesmo às sessões livres e fecha as paradas há `max_idle` s
+      - se o servidor fechou a sessão (timeout, 421, …) reconecta e repete uma vez
+      - `get_settings()` -> (servidor, porta, utilizador, password), lido a cada envio;
+        se mudar (Ferramentas • SMTP) as sessões antigas são descartadas
+    """
+
+    def __init__(self, get_settings, size: int = 1, keepalive: float = 60.0, max_idle: float = 900.0,
+                 timeout: float = 60.0, force_ipv4: bool = False, local_hostname: str = "asf-checkin"):
+        self._get_settings = get_settings
+        self.size = max(1, size)
+        self.keepalive = keepalive
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.force_ipv4 = force_ipv4
+        self.local_hostname = local_hostname
+
+        self._lock = threading.Lock()
+        self._idle: list[_Session] = []
+        self._stats = {"sent": 0, "connects": 0, "reconnects": 0, "noops": 0, "errors": 0}
+        self._thread = None
+
+    # ---------- API ----------
+    def send(self, msg, to_addrs=None) -> str:
+        """Envia `msg` (EmailMessage). Devolve o "ip:porta" usado; levanta exceção se falhar."""
+        settings = self._current_settings()
+        sess = self._acquire(settings)
+        try:
+            try:
+                self._send_on(sess, msg, to_addrs)
+            except Exception as e:
+                if not _session_dead(e):
+                    raise
+                logger.info("SMTP: sessão caiu (%r); a reconectar", e)
+                sess.close()
+                with self._lock:
+                    self._stats["reconnects"] += 1
+                sess = self._open(settings)
+                self._send_on(sess, msg, to_addrs)
+        except Exception:
+            sess.close()
+            with self._lock:
+                self._stats["errors"] += 1
+            raise
+        self._release(sess)
+        return sess.peer
+
+    def reset(self) -> None:
+        """Fecha todas as sessões livres (definições SMTP alteradas, p.ex.)."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for s in idle:
+            s.close()
+
+    close = reset
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "idle": len(self._idle)}
+
+    def start_keepalive(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._keepalive_loop, name="SmtpKeepalive", daemon=True)
+        self._thread.start()
+
+    # ---------- internos ----------
+    def _current_settings(self) -> tuple:
+        settings = tuple(self._get_settings())
+        if not settings[0]:
+            raise RuntimeError("SMTP_SERVER não definido")
+        return settings
+
+    def _acquire(self, settings) -> _Session:
+        while True:
+            with self._lock:
+                sess = self._idle.pop() if self._idle else None
+            if sess is None:
+                return self._open(settings)
+            now = time.monotonic()
+            if sess.settings != settings or now - sess.last_sent >= self.max_idle:
+                sess.close()
+                continue
+            if now - sess.last_used >= self.keepalive and not self._noop(sess):
+                continue
+            return sess
+
+    def _release(self, sess: _Session) -> None:
+        sess.last_sent = sess.last_used = time.monotonic()
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(sess)
+                return
+        sess.close()
+
+    def _noop(self, sess: _Session) -> bool:
+        try:
+            code, _ = sess.smtp.noop()
+            with self._lock:
+                self._stats["noops"] += 1
+            if code == 250:
+                sess.last_used = time.monotonic()
+                return True
+        except Exception:
+            pass
+        sess.close()
+        return False
+
+    def _send_on(self, sess: _Session, msg, to_addrs) -> None:
+        mail_opts = ["SMTPUTF8"] if sess.utf8 else []
+        sess.smtp.send_message(msg, to_addrs=to_addrs, mail_options=mail_opts)
+        with self._lock:
+            self._stats["sent"] += 1
+
+    def _open(self, settings) -> _Session:
+        """DNS (IPv4 primeiro) -> TLS -> banner -> EHLO -> login. Tenta cada IP."""
+        server_name, port, user, password = settings
+        family = socket.AF_INET if self.force_ipv4 else socket.AF_UNSPEC
+        infos = socket.getaddrinfo(server_name, port, family, socket.SOCK_STREAM)
+        infos.sort(key=lambda x: 0 if x[0] == socket.AF_INET else 1)
+        context = ssl.create_default_context()
+
+        last_err = None
+        for af, _, _, _, sockaddr in infos:
+            ip = sockaddr[0]
+            ipver = "IPv4" if af == socket.AF_INET else "IPv6"
+            raw = None
+            try:
+                logger.info("SMTP: ligar %s %s:%s (%s)", server_name, ip, port, ipver)
+                raw = socket.create_connection((ip, port), timeout=self.timeout)
+                tls_sock = context.wrap_socket(raw, server_hostname=server_name)
+                smtp = smtplib.SMTP_SSL()
+                smtp.sock = tls_sock
+                smtp.file = tls_sock.makefile("rb")
+                code, banner = smtp.getreply()
+                if code != 220:
+                    smtp.close()
+                    raise smtplib.SMTPResponseException(code, banner)
+                smtp.ehlo(self.local_hostname)
+                if user:
+                    smtp.login(user, password)
+                with self._lock:
+                    self._stats["connects"] += 1
+                return _Session(smtp, settings, f"{ip}:{port}")
+            except Exception as e:
+                last_err = e
+                logger.error("SMTP: falha via %s %s:%s | err=%r", ipver, ip, port, e)
+                if raw is not None:
+                    try:
+                        raw.close()
+                    except Exception:
+                        pass
+        raise last_err or OSError(f"SMTP: sem endereços para {server_name}")
+
+    def _keepalive_loop(self):
+        while True:
+            time.sleep(self.keepalive)
+            with self._lock:
+                idle, self._idle = self._idle, []
+            keep = []
+            now = time.monotonic()
+            for sess in idle:
+                if now - sess.last_sent >= self.max_idle:
+                    sess.close()
+                elif self._noop(sess):
+                    keep.append(sess)
+            with self._lock:
+                self._idle.extend(keep)
+                while len(self._idle) > self.size:
+                    self._idle.pop(0).close()
@@ -0,0 +1,113 @@
+# student_directory.py — alunos em memória (número -> registo leve), partilhado pela UI e pelo check-in
+import os
+import threading
+import time
+import logging
+
+import db
+
+logger = logging.getLogger("app")
+
+# intervalo da verificação incremental (alunos novos) e da recarga completa (edições noutros postos)
+REFRESH_SECONDS     = int(os.getenv("STUDENT_DIR_REFRESH", "30") or "30")
+FULL_RELOAD_SECONDS = int(os.getenv("STUDENT_DIR_FULL_RELOAD", "600") or "600")
+
+
+class StudentDirectory:
+    """
+    Mapa student_number -> dict com os campos leves de db.STUDENT_FIELDS.
+      - warm(): carga completa (arranque)
+      - get(): lookup O(1); num "miss" vai à BD só se load=True
+      - invalidate(): chamado pelo db.py sempre que um aluno é criado/editado/apagado
+      - refresh em background: alunos novos (id > último visto) + recarga completa periódica
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_number: dict[int, dict] = {}
+        self._max_id = 0
+        self._loaded = False
+        self._last_full = 0.0
+        self._thread = None
+
+    # ---------- carga ----------
+    def warm(self) -> int:
+        """Recarrega tudo da BD. Devolve o nº de alunos em memória."""
+        rows = db.fetch_student_directory()
+        by_number = {int(r["student_number"]): r for r in rows}
+        with self._lock:
+            self._by_number = by_number
+            self._max_id = max((int(r["id"]) for r in rows), default=0)
+            self._loaded = True
+            self._last_full = time.monotonic()
+        logger.info(f"[DIR] {len(by_number)} aluno(s) em memória")
+        return len(by_number)
+
+    def refresh_incremental(self) -> int:
+        """Acrescenta alunos criados desde a última leitura (noutro posto, p.ex.)."""
+        with self._lock:
+            since = self._max_id
+        rows = db.fetch_student_directory(since_id=since)
+        if rows:
+            with self._lock:
+                for r in rows:
+                    self._by_number[int(r["student_number"])] = r
+                    self._max_id = max(self._max_id, int(r["id"]))
+        return len(rows)
+
+    # ---------- acesso ----------
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def get(self, student_number: int, load: bool = True) -> dict | None:
+        """Registo leve do aluno; num miss vai à BD (load=True) e guarda o resultado."""
+        n = int(student_number)
+        with self._lock:
+            row = self._by_number.get(n)
+        if row is not None or not load:
+            return row
+        row = db.get_student_by_number(n)
+        if row:
+            with self._lock:
+                self._by_number[n] = row
+        return row
+
+    def invalidate(self, student_number: int) -> None:
+        with self._lock:
+            self._by_number.pop(int(student_number), None)
+
+    def snapshot(self, active_only: bool = True) -> dict[str, dict]:
+        """Cópia {str(student_number): registo} (formato usado por CheckinApp.students)."""
+        with self._lock:
+            rows = list(self._by_number.values())
+        return {
+            str(r["student_number"]): r for r in rows
+            if not active_only or r.get("active") in (None, 1, True)
+        }
+
+    def __len__(self):
+        with self._lock:
+            return len(self._by_number)
+
+    # ---------- background ----------
+    def start_background_refresh(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._refresh_loop, name="StudentDirectory", daemon=True)
+        self._thread.start()
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(REFRESH_SECONDS)
+            try:
+                if not self._loaded or time.monotonic() - self._last_full >= FULL_RELOAD_SECONDS:
+                    self.warm()
+                else:
+                    self.refresh_incremental()
+            except Exception as e:
+                logger.warning(f"[DIR] refresh falhou: {e}")
+
+
+directory = StudentDirectory()
+db.on_student_changed(directory.invalidate)
@@ -0,0 +1,82 @@
+# tests/test_auto_logout.py — o UPDATE do logout automático também apanha students.status NULL
+import os
+import re
+import sqlite3
+import sys
+from datetime import date, datetime
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("pymysql")
+pytest.importorskip("dotenv")
+import db
+
+
+class _FakeCursor:
+    def __init__(self):
+        self.sql = []
+        self.rowcount = 0
+        self.lastrowid = 0
+
+    def execute(self, sql, params=None):
+        self.sql.append(sql)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _FakeConn:
+    def __init__(self):
+        self.cur = _FakeCursor()
+
+    def cursor(self):
+        return self.cur
+
+    def begin(self):
+        pass
+
+    def commit(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def _status_update_where(monkeypatch) -> str:
+    conn = _FakeConn()
+    monkeypatch.setattr(db, "_connect", lambda: conn)
+    monkeypatch.setattr(db, "_schema_cache", {
+        "students": frozenset({"id", "status"}),
+        "checkins": frozenset({"id", "student_id", "timestamp", "action"}),
+        "student_last_checkin": frozenset(),
+    })
+    db.auto_logout_stale_entries(ts=datetime(2026, 1, 2, 23, 0))
+    update = next(s for s in conn.cur.sql if "UPDATE students" in s)
+    return re.search(r"WHERE(.*)", update, re.S).group(1).strip()
+
+
+def test_null_status_is_logged_out(monkeypatch):
+    where = _status_update_where(monkeypatch)
+
+    # avalia o mesmo WHERE num SQLite (a semântica de NULL é a mesma da MariaDB)
+    lite = sqlite3.connect(":memory:")
+    lite.create_function("CURDATE", 0, lambda: date.today().isoformat())
+    lite.executescript("""
+        CREATE TABLE students (id INTEGER, status TEXT);
+        CREATE TABLE m (student_id INTEGER, timestamp TEXT);
+        INSERT INTO students VALUES (1, NULL), (2, 'Entrada'), (3, 'Saída'), (4, NULL);
+        INSERT INTO m VALUES (1, '2000-01-01 10:00:00'), (2, '2000-01-01 10:00:00'),
+                             (3, '2000-01-01 10:00:00');
+    """)
+    hit = [r[0] for r in lite.execute(
+        f"SELECT s.id FROM students s LEFT JOIN m ON m.student_id = s.id WHERE {where} ORDER BY s.id")]
+
+    assert hit == [1, 2, 4]
@@ -0,0 +1,40 @@
+# tests/test_db_errors.py — ligação perdida vs. conflito de locks
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pymysql = pytest.importorskip("pymysql")
+pytest.importorskip("dotenv")
+import db
+
+
+def test_only_connection_loss_is_unavailable():
+    assert db.is_unavailable(pymysql.err.OperationalError(2013, "Lost connection"))
+    assert db.is_unavailable(pymysql.err.InterfaceError(0, ""))
+    assert db.is_unavailable(TimeoutError("Pool da BD esgotado"))
+    assert not db.is_unavailable(pymysql.err.OperationalError(1213, "Deadlock found"))
+    assert not db.is_unavailable(pymysql.err.OperationalError(1205, "Lock wait timeout"))
+
+
+def test_lock_conflict_is_retried_in_place(monkeypatch):
+    monkeypatch.setattr(db, "DB_LOCK_RETRIES", 2)
+    monkeypatch.setattr(db.time, "sleep", lambda s: None)
+    calls = []
+
+    @db._retry_on_lock_conflict
+    def tx():
+        calls.append(1)
+        if len(calls) < 3:
+            raise pymysql.err.OperationalError(1213, "Deadlock found")
+        return "ok"
+
+    assert tx() == "ok" and len(calls) == 3
+
+    calls.clear()
+    monkeypatch.setattr(db, "DB_LOCK_RETRIES", 1)
+    with pytest.raises(pymysql.err.OperationalError):
+        tx()
+    assert len(calls) == 2
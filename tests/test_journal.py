@@ -0,0 +1,50 @@
+# tests/test_journal.py — commit depois de uma compactação feita entre o peek e o commit
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from journal import Journal
+
+
+def _drain(j):
+    rows, _ = j.peek()
+    return [r["n"] for r in rows]
+
+
+def test_commit_after_compaction_between_peek_and_commit(tmp_path):
+    path = str(tmp_path / "pending.jsonl")
+    j = Journal(path, compact_bytes=1)
+    for n in range(20):
+        j.append({"n": n})
+
+    _, mark = j.peek(5)
+    j.commit(mark)                 # 0–4 consumidos
+    rows, mark = j.peek(5)         # 5–9 "em envio"
+    assert [r["n"] for r in rows] == list(range(5, 10))
+    j._compact()                   # o thread de manutenção reescreve o ficheiro entretanto
+    j.commit(mark)
+
+    assert _drain(j) == list(range(10, 20))
+    j.close()
+
+    reopened = Journal(path, compact_bytes=1)
+    assert _drain(reopened) == list(range(10, 20))
+    reopened.close()
+
+
+def test_reopen_keeps_unconsumed_records(tmp_path):
+    path = str(tmp_path / "pending.jsonl")
+    j = Journal(path)
+    for n in range(6):
+        j.append({"n": n})
+    _, mark = j.peek(2)
+    j.commit(mark)
+    j.close()
+
+    reopened = Journal(path)
+    assert _drain(reopened) == [2, 3, 4, 5]
+    _, mark = reopened.peek(1)
+    reopened.commit(mark)
+    assert _drain(reopened) == [3, 4, 5]
+    reopened.close()
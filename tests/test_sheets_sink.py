@@ -0,0 +1,55 @@
+# tests/test_sheets_sink.py — com o circuito aberto e um lote cheio, o sink não fica em ciclo
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from breaker import CircuitBreaker
+from sheets_sink import SheetsSink
+
+
+class _Journal:
+    def __init__(self, n):
+        self.rows = [[i] for i in range(n)]
+
+    def append(self, row):
+        self.rows.append(row)
+
+    def peek(self, limit=None):
+        return self.rows[:limit], len(self.rows[:limit])
+
+    def commit(self, mark):
+        del self.rows[:mark]
+
+    def pending_count(self):
+        return len(self.rows)
+
+    def sync(self):
+        pass
+
+
+class _Sheet:
+    def append_rows(self, rows):
+        raise AssertionError("com o circuito aberto não se chama o Sheets")
+
+
+class _CountingSink(SheetsSink):
+    flushes = 0
+
+    def flush(self, force=False):
+        type(self).flushes += 1
+        return super().flush(force)
+
+
+def test_open_breaker_backs_off_with_full_batch_pending():
+    breaker = CircuitBreaker("sheets", failure_threshold=1, cooloff=30)
+    breaker.failure(RuntimeError("Sheets em baixo"))
+    journal = _Journal(20)
+
+    sink = _CountingSink(lambda: _Sheet(), journal, interval=5.0, batch_size=10, breaker=breaker)
+    time.sleep(0.3)
+
+    assert _CountingSink.flushes <= 1
+    assert journal.pending_count() == 20
+    assert sink.stats()["backoff_s"] > 0
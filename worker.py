@@ -1,31 +1,274 @@
 # worker.py
-import threading, queue, traceback
+import os, threading, queue, traceback, time, itertools, zlib
+from concurrent.futures import Future
+from collections import deque
 
-_Q = queue.Queue()
+# N threads, uma fila por thread ("shard"). Trabalhos com a mesma key (nº de aluno)
+# vão sempre para o mesmo shard -> Entrada/Saída do mesmo aluno ficam por ordem;
+# alunos diferentes correm em paralelo. Sem key: distribuídos em round-robin.
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", "4") or "4")
+
+# Prioridades (cada shard serve sempre primeiro a faixa mais baixa que tiver trabalho)
+INTERACTIVE, SINK, MAINTENANCE = 0, 1, 2
+_LANE_NAMES = ("interactive", "sink", "maintenance")
+
+# Limite por shard e o que fazer quando está cheio:
+#   drop_oldest — descarta o trabalho mais antigo da faixa menos prioritária (≥ à do novo)
+#   drop_new    — recusa o novo
+#   block       — espera por espaço (nunca a partir do thread do Tk)
+#   raise       — levanta queue.Full
+# Trabalhos INTERACTIVE (check-ins) nunca são descartados: entram mesmo acima do limite.
+WORKER_QUEUE_MAX = int(os.getenv("WORKER_QUEUE_MAX", "500") or "500")
+WORKER_OVERFLOW  = (os.getenv("WORKER_OVERFLOW", "drop_oldest") or "drop_oldest").strip().lower()
+
+
+class _Job:
+    __slots__ = ("func", "args", "kwargs", "on_done", "on_error", "queued_at", "lane", "coalesce")
+
+    def __init__(self, func, args, kwargs, on_done, on_error, lane, coalesce):
+        self.func, self.args, self.kwargs = func, args, kwargs
+        self.on_done, self.on_error = on_done, on_error
+        self.queued_at = time.monotonic()
+        self.lane = lane
+        self.coalesce = coalesce
+
+
+class _Shard:
+    """Fila de um thread: uma deque por faixa + índice de trabalhos coalescíveis ainda na fila."""
+
+    def __init__(self, maxsize, overflow):
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self._cond = threading.Condition()
+        self._lanes = [deque() for _ in _LANE_NAMES]
+        self._coalesce: dict = {}
+        self._size = 0
+
+    def qsize(self):
+        with self._cond:
+            return self._size
+
+    def lane_sizes(self):
+        with self._cond:
+            return [len(l) for l in self._lanes]
+
+    def put(self, job):
+        """Devolve (aceite, descartado): `descartado` é o _Job que saiu por overflow (ou o próprio)."""
+        with self._cond:
+            if job.coalesce is not None:
+                queued = self._coalesce.get(job.coalesce)
+                if queued is not None:
+                    # já há um igual na fila: fica só um, com os argumentos/callbacks mais recentes
+                    queued.func, queued.args, queued.kwargs = job.func, job.args, job.kwargs
+                    queued.on_done, queued.on_error = job.on_done, job.on_error
+                    return False, None
+            dropped = None
+            if self.maxsize and self._size >= self.maxsize and job.lane != INTERACTIVE:
+                if self.overflow == "block":
+                    while self._size >= self.maxsize:
+                        self._cond.wait()
+                elif self.overflow == "raise":
+                    raise queue.Full(f"fila do worker cheia ({self._size})")
+                elif self.overflow == "drop_new":
+                    return False, job
+                else:   # drop_oldest
+                    victim_lane = next((i for i in range(len(self._lanes) - 1, job.lane - 1, -1)
+                                        if self._lanes[i]), None)
+                    if victim_lane is None:
+                        return False, job
+                    dropped = self._lanes[victim_lane].popleft()
+                    self._forget(dropped)
+                    self._size -= 1
+            self._lanes[job.lane].append(job)
+            if job.coalesce is not None:
+                self._coalesce[job.coalesce] = job
+            self._size += 1
+            self._cond.notify_all()
+            return True, dropped
+
+    def get(self):
+        with self._cond:
+            while not self._size:
+                self._cond.wait()
+            job = next(l for l in self._lanes if l).popleft()
+            self._forget(job)
+            self._size -= 1
+            self._cond.notify_all()
+            return job
+
+    def _forget(self, job):
+        if job.coalesce is not None and self._coalesce.get(job.coalesce) is job:
+            del self._coalesce[job.coalesce]
+
+
+_SHARDS: list[_Shard] = []
 _UI_AFTER = None
+_RR = itertools.count()
+_STATS_LOCK = threading.Lock()
+_STATS = {"jobs": 0, "errors": 0, "in_flight": 0, "coalesced": 0, "dropped": 0}
+_LATENCY: dict[str, dict] = {}    # nome da função -> {count, avg_ms, max_ms, wait_ms}
 
-def init(root, *, worker_name="IOWorker"):
+def init(root, *, worker_name="IOWorker", workers=None):
     """Chama isto uma vez (no arranque) com o root do Tk."""
     global _UI_AFTER
     _UI_AFTER = root.after
-    t = threading.Thread(target=_loop, name=worker_name, daemon=True)
-    t.start()
+    if _SHARDS:
+        return
+    for i in range(max(1, workers or WORKER_THREADS)):
+        shard = _Shard(WORKER_QUEUE_MAX, WORKER_OVERFLOW)
+        _SHARDS.append(shard)
+        threading.Thread(target=_loop, args=(shard,), name=f"{worker_name}-{i}", daemon=True).start()
 
-def _loop():
+def _record(name, wait_ms, run_ms, ok):
+    with _STATS_LOCK:
+        _STATS["jobs"] += 1
+        _STATS["in_flight"] -= 1
+        if not ok:
+            _STATS["errors"] += 1
+        lat = _LATENCY.setdefault(name, {"count": 0, "avg_ms": 0.0, "max_ms": 0.0, "wait_ms": 0.0})
+        lat["count"] += 1
+        lat["avg_ms"] += (run_ms - lat["avg_ms"]) / lat["count"]
+        lat["max_ms"] = max(lat["max_ms"], run_ms)
+        lat["wait_ms"] += (wait_ms - lat["wait_ms"]) / lat["count"]
+
+def _loop(shard):
     while True:
-        func, args, kwargs, on_done, on_error = _Q.get()
+        job = shard.get()
+        started = time.monotonic()
+        with _STATS_LOCK:
+            _STATS["in_flight"] += 1
+        ok = True
         try:
-            res = func(*args, **kwargs)
-            if on_done and _UI_AFTER:
-                _UI_AFTER(0, lambda r=res: on_done(r))
+            res = job.func(*job.args, **job.kwargs)
+            if isinstance(res, Future):
+                _deliver_when_done(res, job)   # resultado chega mais tarde (p.ex. group commit)
+            elif job.on_done and _UI_AFTER:
+                _UI_AFTER(0, lambda r=res, cb=job.on_done: cb(r))
         except Exception as e:
+            ok = False
             tb = traceback.format_exc()
             print("[worker] erro:", e, "\n", tb)
-            if on_error and _UI_AFTER:
-                _UI_AFTER(0, lambda: on_error(e))
+            if job.on_error and _UI_AFTER:
+                _UI_AFTER(0, lambda e=e, cb=job.on_error: cb(e))
         finally:
-            _Q.task_done()
+            done = time.monotonic()
+            _record(getattr(job.func, "__name__", "job"),
+                    (started - job.queued_at) * 1000.0, (done - started) * 1000.0, ok)
+
+def _deliver_when_done(fut, job):
+    """Trabalho que devolveu um Future: on_done/on_error quando ele resolver (o shard segue)."""
+    def _cb(f):
+        e = f.exception()
+        if e is None:
+            if job.on_done and _UI_AFTER:
+                _UI_AFTER(0, lambda r=f.result(), cb=job.on_done: cb(r))
+            return
+        print("[worker] erro:", e)
+        if job.on_error and _UI_AFTER:
+            _UI_AFTER(0, lambda e=e, cb=job.on_error: cb(e))
+    fut.add_done_callback(_cb)
+
+def _shard_for(key):
+    if key is None:
+        return _SHARDS[next(_RR) % len(_SHARDS)]
+    return _SHARDS[zlib.crc32(str(key).encode("utf-8")) % len(_SHARDS)]
+
+def enqueue(func, *args, key=None, lane=INTERACTIVE, coalesce=None, on_done=None, on_error=None, **kwargs):
+    """
+    Mete uma função pesada na fila. Nunca bloqueia o UI (exceto com WORKER_OVERFLOW=block).
+    `key` (p.ex. nº de aluno): trabalhos com a mesma key correm por ordem, no mesmo thread.
+    `lane`: INTERACTIVE (check-in) > SINK > MAINTENANCE.
+    `coalesce`: se já houver na fila um trabalho com a mesma chave, fica só esse
+    (com os argumentos mais recentes). Devolve False se o trabalho não entrou como novo.
+    Se `func` devolver um concurrent.futures.Future, on_done/on_error correm quando ele
+    resolver — o shard não fica à espera.
+    """
+    if not _SHARDS:
+        raise RuntimeError("worker.init(root) ainda não foi chamado")
+    job = _Job(func, args, kwargs, on_done, on_error, lane, coalesce)
+    accepted, dropped = _shard_for(key if key is not None else coalesce).put(job)
+    with _STATS_LOCK:
+        if not accepted and dropped is None:
+            _STATS["coalesced"] += 1
+        elif dropped is not None:
+            _STATS["dropped"] += 1
+    if dropped is not None:
+        print(f"[worker] fila cheia: descartado {getattr(dropped.func, '__name__', 'job')} "
+              f"({_LANE_NAMES[dropped.lane]})")
+        if dropped.on_error and _UI_AFTER:
+            err = queue.Full("fila do worker cheia")
+            _UI_AFTER(0, lambda cb=dropped.on_error: cb(err))
+    return accepted
+
+def stats() -> dict:
+    """Profundidade das filas (por faixa e shard), trabalhos em curso e latência por tipo de trabalho."""
+    lanes = [0] * len(_LANE_NAMES)
+    for shard in _SHARDS:
+        for i, n in enumerate(shard.lane_sizes()):
+            lanes[i] += n
+    with _STATS_LOCK:
+        return {
+            **_STATS,
+            "threads": len(_SHARDS),
+            "depth": sum(lanes),
+            "depth_by_lane": dict(zip(_LANE_NAMES, lanes)),
+            "depth_by_shard": [shard.qsize() for shard in _SHARDS],
+            "latency": {name: {k: round(v, 1) if isinstance(v, float) else v for k, v in lat.items()}
+                        for name, lat in _LATENCY.items()},
+        }
+
+
+# ---------------- stages (sinks com fila e thread próprias) ----------------
+class Stage:
+    """
+    Fila + thread dedicadas a um "sink" (Sheets, CSV, email, cache…).
+    Cada stage avança ao seu ritmo: um sink lento não atrasa os outros
+    nem a confirmação do check-in na UI. Depois de close(), submit() corre o
+    handler logo, no thread de quem chama.
+    """
+
+    def __init__(self, name, handler, maxsize=0):
+        self.name = name
+        self._handler = handler
+        self._q = queue.Queue(maxsize)
+        self.processed = 0
+        self.failed = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._loop, name=f"Stage-{name}", daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        if self._closed:
+            self._run(item)
+            return
+        self._q.put(item)
+
+    def close(self):
+        """Deixa de aceitar itens na fila (os que lá estão continuam; ver drain())."""
+        self._closed = True
+
+    def depth(self):
+        return self._q.qsize()
+
+    def drain(self, timeout=5.0):
+        """Espera (até timeout) que a fila esvazie. Devolve True se ficou vazia."""
+        deadline = time.monotonic() + timeout
+        while self._q.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return not self._q.unfinished_tasks
+
+    def _run(self, item):
+        try:
+            self._handler(item)
+            self.processed += 1
+        except Exception as e:
+            self.failed += 1
+            print(f"[stage:{self.name}] erro:", e, "\n", traceback.format_exc())
 
-def enqueue(func, *args, on_done=None, on_error=None, **kwargs):
-    """Mete uma função pesada na fila. Nunca bloqueia o UI."""
-    _Q.put((func, args, kwargs, on_done, on_error))
+    def _loop(self):
+        while True:
+            item = self._q.get()
+            try:
+                self._run(item)
+            finally:
+                self._q.task_done()